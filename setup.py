@@ -35,4 +35,8 @@ setup(
     'requests', # used by vast_python to connect to the api server
     'borb' # vast_python imports this for generating pdfs, not presently used
   ],
+  extras_require={
+    'async': ['aiohttp'], # used by AsyncVast and the Instance a-prefixed methods
+    'offers': ['numpy'], # used by OfferTable
+  },
 )
@@ -0,0 +1,49 @@
+import asyncio, threading, time
+
+from vast import Vast
+from vast.cache import SingleFlight
+from vast.mock import MockVast
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+    def slow():
+        calls.append(None)
+        entered.set()
+        release.wait()
+        return len(calls)
+    results = []
+    leader = threading.Thread(target = lambda: results.append(flights.do('key', slow)))
+    leader.start()
+    entered.wait()
+    followers = [threading.Thread(target = lambda: results.append(flights.do('key', slow))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flights.calls < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in (leader, *followers):
+        thread.join()
+    assert results == [1] * 4
+    assert flights.stats() == dict(calls = 4, coalesced = 3)
+
+def test_fresh_reads_reused_until_a_write():
+    with MockVast(market_size = 2) as mock:
+        vast = Vast(url = mock.url, key = 'k', fresh = 60)
+        assert vast.instances() == []
+        assert vast.instances() == []
+        assert mock.counts['GET', '/instances'] == 1
+
+        instance_id = vast.create(1, 'image')
+        assert [row['id'] for row in vast.instances()] == [instance_id]
+        assert mock.counts['GET', '/instances'] == 2
+
+def test_fresh_reads_see_async_writes():
+    with MockVast(market_size = 2) as mock:
+        vast = Vast(url = mock.url, key = 'k', fresh = 60)
+        assert vast.poller.poll() == {}
+        instance_id = asyncio.run(vast.avast.create(1, 'image'))
+        assert list(vast.poller.poll()) == [instance_id]
+        asyncio.run(vast.avast.destroy(instance_id))
+        assert vast.poller.poll() == {}
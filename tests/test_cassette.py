@@ -0,0 +1,31 @@
+import gzip
+
+import pytest
+
+from vast import Vast, VastException
+from vast.cassette import RecordingSession, ReplaySession
+from vast.mock import MockVast
+
+@pytest.mark.parametrize('name', ['cassette.jsonl', 'cassette.jsonl.gz'])
+def test_keys_left_out_and_replayed_under_another(tmp_path, name):
+    path = str(tmp_path / name)
+    with MockVast(market_size = 3) as mock:
+        with RecordingSession(path) as session:
+            vast = Vast(url = mock.url, key = 'secret-key-123', session = session)
+            user = vast.request('GET', '/users/current')
+            assert user['api_key'] == 'secret-key-123'
+            instance_id = vast.create(1, 'image')
+            recorded = vast.instances()
+
+    with open(path, 'rb') as reader:
+        content = reader.read()
+    if name.endswith('.gz'):
+        content = gzip.decompress(content)
+    assert b'secret-key-123' not in content
+
+    vast = Vast(url = 'http://127.0.0.1:9', key = 'another-key', session = ReplaySession(path))
+    assert vast.request('GET', '/users/current') == {key: value for key, value in user.items() if key != 'api_key'}
+    assert vast.create(1, 'image') == instance_id
+    assert vast.instances() == recorded
+    with pytest.raises(VastException, match = 'not in cassette'):
+        vast.destroy(instance_id)
@@ -0,0 +1,25 @@
+import time
+
+from vast import Vast, Fleet
+from vast.costs import CostTracker
+from vast.mock import MockVast
+
+def test_budget_destroys_through_instances():
+    with MockVast(market_size = 4) as mock:
+        vast = Vast(url = mock.url, key = 'k')
+        fleet = Fleet(vast, image = 'image')
+        fleet.launch(2, 'rentable=true', wait = False)
+        taken = {instance.offer['id'] for instance in fleet.instances}
+        unowned_id = vast.create(next(id for id, offer in mock.offers.items() if offer['rentable'] and id not in taken), 'image')
+        vast.poller.poll()
+        tracker = CostTracker(vast)
+        tracker.group('fleet', [*fleet.instances, unowned_id])
+        tracker.budget('fleet', 0)
+
+        assert tracker.check(time.time()) == ['fleet']
+        assert mock.instances == {}
+        assert [instance.id for instance in fleet.instances] == [None, None]
+
+        # the destroyed Instances hold no ids, so destroying them again sends nothing
+        fleet.destroy()
+        assert mock.counts['DELETE', '/instances/{id}/'] == 3
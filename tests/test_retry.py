@@ -0,0 +1,109 @@
+import email.utils, socket, time
+
+import pytest
+
+from vast import Vast, VastException
+from vast.mock import MockVast
+from vast.retry import RetryPolicy, CircuitBreaker, retry_after
+
+def make_vast(mock, retries = 3, threshold = 100, cooldown = 30, **kwparams):
+    vast = Vast(url = mock.url, key = 'k', rate = 1000, burst = 1000, **kwparams)
+    vast.http.policy = RetryPolicy(retries, base = 0.001, maximum = 0.01)
+    vast.http.breaker = CircuitBreaker(threshold, cooldown)
+    return vast
+
+def test_server_errors_retried_up_to_limit():
+    with MockVast(market_size = 1, error_rate = 1) as mock:
+        vast = make_vast(mock, retries = 3)
+        with pytest.raises(VastException, match = '500'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 4
+        assert vast.http.retries == 3
+
+def test_throttling_honors_retry_after():
+    # the mock asks for no delay, so a long backoff would show the header was ignored
+    with MockVast(market_size = 1, throttle_rate = 1) as mock:
+        vast = make_vast(mock, retries = 3)
+        vast.http.policy = RetryPolicy(3, base = 10, maximum = 10)
+        start = time.monotonic()
+        with pytest.raises(VastException, match = '429'):
+            vast.instances()
+        assert time.monotonic() - start < 2
+        assert mock.counts['GET', '/instances'] == 4
+        assert vast.http.throttled == 4
+
+def test_retry_after_parsing():
+    assert retry_after({}) is None
+    assert retry_after({'Retry-After': '3'}) == 3
+    assert retry_after({'Retry-After': '-1'}) == 0
+    assert 8 < retry_after({'Retry-After': email.utils.formatdate(time.time() + 10, usegmt = True)}) <= 10
+    assert RetryPolicy(maximum = 5).delay(0, 60) == 5
+
+def test_breaker_opens_and_fails_fast():
+    with MockVast(market_size = 1, error_rate = 1) as mock:
+        vast = make_vast(mock, retries = 10, threshold = 3)
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 3
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 3
+
+def test_breaker_half_open():
+    with MockVast(market_size = 1, error_rate = 1) as mock:
+        vast = make_vast(mock, retries = 10, threshold = 2, cooldown = 0.2)
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 2
+
+        # a failed trial call reopens the breaker
+        time.sleep(0.25)
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 3
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert mock.counts['GET', '/instances'] == 3
+
+        # a successful one closes it
+        time.sleep(0.25)
+        mock.error_rate = 0
+        assert vast.instances() == []
+        assert vast.http.breaker.failures == 0
+        assert vast.instances() == []
+        assert mock.counts['GET', '/instances'] == 5
+
+def test_create_not_retried_on_server_error():
+    with MockVast(market_size = 1, error_rate = 1) as mock:
+        vast = make_vast(mock, retries = 3)
+        with pytest.raises(VastException, match = '500'):
+            vast.create(1, 'image')
+        assert mock.counts['PUT', '/asks/{id}/'] == 1
+
+def test_cmd_create_not_retried_on_server_error():
+    pytest.importorskip('vast.vast_python.vast', reason = 'the vast_python submodule is not checked out')
+    with MockVast(market_size = 1, error_rate = 1) as mock:
+        vast = make_vast(mock, retries = 3, native = False)
+        vast.key = None
+        with pytest.raises(VastException, match = '500'):
+            vast.create(1, 'image')
+        assert mock.counts['PUT', '/asks/{id}/'] == 1
+
+def test_create_retried_when_throttled():
+    with MockVast(market_size = 1, throttle_rate = 1) as mock:
+        vast = make_vast(mock, retries = 3)
+        with pytest.raises(VastException, match = '429'):
+            vast.create(1, 'image')
+        assert mock.counts['PUT', '/asks/{id}/'] == 4
+
+def test_unanswered_requests_time_out_and_trip_breaker():
+    # accepts connections but never replies
+    with socket.create_server(('127.0.0.1', 0), backlog = 16) as server:
+        vast = Vast(url = f'http://127.0.0.1:{server.getsockname()[1]}', key = 'k', timeout = 0.2)
+        vast.http.policy = RetryPolicy(10, base = 0.001, maximum = 0.01)
+        vast.http.breaker = CircuitBreaker(3, 30)
+        start = time.monotonic()
+        with pytest.raises(VastException, match = 'unavailable'):
+            vast.instances()
+        assert time.monotonic() - start < 5
+        assert vast.http.breaker.failures == 3
@@ -0,0 +1,57 @@
+import gc
+
+from vast import Vast, Instance
+from vast.mock import MockVast
+from vast.store import Store
+from vast.watcher import OfferWatcher
+
+def requests_made(mock):
+    return sum(mock.counts.values())
+
+def test_cold_start_and_restore(tmp_path):
+    path = str(tmp_path / 'store.db')
+    with MockVast(market_size = 10) as mock:
+        vast = Vast(url = mock.url, key = 'k', store = path)
+        owned = [Instance(vast = vast, query = 'rentable=true', image = 'image') for _ in range(3)]
+        for instance in owned:
+            instance.create()
+        owned_ids = [instance.id for instance in owned]
+        unowned_id = vast.create(next(id for id, offer in mock.offers.items() if offer['rentable']), 'image')
+        vast.poller.poll()
+        del owned, instance
+        gc.collect()
+        vast.store.close()
+        assert len(mock.instances) == 4 # owned instances outlive their objects
+
+        vast.destroy(owned_ids[0]) # gone while the controller was down
+        before = requests_made(mock)
+
+        vast = Vast(url = mock.url, key = 'k', store = path)
+        machine_id = mock.instances[unowned_id]['machine_id']
+        detached = Instance(instance_id = unowned_id, machine_id = machine_id, vast = vast)
+        assert requests_made(mock) == before
+        assert detached.actual_status == 'running'
+
+        restored = Instance.restore(vast)
+        assert requests_made(mock) == before + 1
+        assert sorted(instance.id for instance in restored) == owned_ids[1:]
+        assert all(instance.offer['id'] == instance.offer_id for instance in restored)
+        assert sorted(vast.store.owned()) == owned_ids[1:]
+
+def test_offer_watcher_resumes_from_snapshot():
+    with MockVast(market_size = 10) as mock:
+        store = Store()
+        watcher = OfferWatcher(Vast(url = mock.url, key = 'k', store = store), query = 'rentable=true')
+        assert len(watcher.poll().added) == 10
+
+        # a restarted watcher reports only what changed since the snapshot
+        vast = Vast(url = mock.url, key = 'k', store = store)
+        watcher = OfferWatcher(vast, query = 'rentable=true')
+        assert len(watcher.offers) == 10
+        mock.perturb(3)
+        changes = watcher.poll()
+        assert not changes.added and not changes.removed
+        assert 0 < len(changes.changed) <= 3
+
+        # other searches have their own snapshots
+        assert OfferWatcher(vast, query = 'rentable=true num_gpus=1').offers == {}
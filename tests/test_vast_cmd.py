@@ -0,0 +1,40 @@
+import os, subprocess, sys, threading, time
+
+import pytest
+
+from vast.mock import MockVast
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_concurrent_commands_run_in_parallel():
+    # output is captured per call, so commands only share argument parsing
+    pytest.importorskip('vast.vast_python.vast', reason = 'the vast_python submodule is not checked out')
+    from vast.vast_cmd import vast_cmd
+    n = 16
+    with MockVast(market_size = 1, latency = 0.25) as mock:
+        argv = ('--url', mock.url, '--raw', 'show', 'instances')
+        start = time.monotonic()
+        single = vast_cmd(*argv)
+        one = time.monotonic() - start
+        results = [None] * n
+        def run(index):
+            results[index] = vast_cmd(*argv)
+        threads = [threading.Thread(target = run, args = (index,)) for index in range(n)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+    assert elapsed < one * 3, f'{n} concurrent calls took {elapsed}s, one took {one}s'
+    assert results == [single] * n
+
+def test_import_does_not_load_vast_python():
+    # vast_python and borb are only imported once a command needs them
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', "import vast; vast.Instance(vast = vast.Vast(url = 'http://127.0.0.1:9', key = 'k'))"],
+        cwd = root, capture_output = True, text = True, check = True,
+    )
+    modules = [line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')]
+    assert 'vast' in modules
+    assert [module for module in modules if module.startswith(('vast.vast_python', 'vast.vast_cmd', 'borb'))] == []
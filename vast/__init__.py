@@ -5,6 +5,15 @@ logger = logging.getLogger(__name__)
 class VastException(Exception):
     pass
 
-from .vast import Vast, vast_cmd
+from .vast import Vast
 from .instance import Instance
+from .fleet import Fleet
+from .watcher import OfferWatcher
 
+def __getattr__(name):
+    # vast_cmd imports vast_python and its dependencies, so it is only loaded when used
+    if name == 'vast_cmd':
+        from .vast_cmd import vast_cmd
+        globals()['vast_cmd'] = vast_cmd
+        return vast_cmd
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
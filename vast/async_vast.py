@@ -0,0 +1,155 @@
+from . import VastException, logger
+from .vast import Vast, offers_query, create_body, add_urls
+from .retry import retry_after, check_success, error_message
+from .metrics import phase, endpoint
+
+import asyncio, weakref
+
+class AsyncVast:
+    '''
+    asyncio counterpart of the Vast instance lifecycle api, using aiohttp.
+
+    Shares its url, key and instance Poller with the wrapped Vast, so sync and async users
+    of the same account see the same status rows.
+
+    aiohttp sessions belong to an event loop, so each running loop gets its own, closed by
+    close() or when the loop shuts down its async generators, as asyncio.run does on exit.
+    '''
+    def __init__(self, vast = None, pool_size = 100, **kwparams):
+        if vast is None:
+            vast = Vast(**kwparams)
+        self.vast = vast
+        self.pool_size = pool_size
+        self._loops = weakref.WeakKeyDictionary() # event loop -> LoopState
+
+    class LoopState:
+        def __init__(self, session, closer):
+            self.session = session
+            self.closer = closer # keeps the closing generator alive, as the loop only holds it weakly
+
+    async def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None or state.session.closed:
+            import aiohttp
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            state = self._loops[loop] = self.LoopState(session, self._closer(session))
+            await state.closer.__anext__()
+        return state
+
+    @staticmethod
+    async def _closer(session):
+        # started async generators are closed by loop.shutdown_asyncgens(), closing the session with its loop
+        try:
+            yield
+        finally:
+            await session.close()
+
+    async def session(self):
+        '''The aiohttp session of the running event loop.'''
+        return (await self._state()).session
+
+    async def close(self):
+        '''Closes the session of the running event loop.'''
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.closer.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def request(self, method, subpath, query = None, body = None, idempotent = True):
+        '''
+        Performs a REST api request without blocking the event loop, returning the decoded json
+        response. Shares the rate limiter, retry policy and circuit breaker of the wrapped Vast.
+        '''
+        with self.vast.metrics.command(endpoint(method, subpath)):
+            with phase('args'):
+                url = self.vast.url_for(subpath, query)
+            http = self.vast.http
+            logger.debug(f'{method} {subpath}')
+            if method in ('GET', 'HEAD'):
+                return await self._request(http, method, url, body, idempotent)
+            # as RetryingSession does, so later reads of either path see the write
+            http.flights.forget()
+            try:
+                return await self._request(http, method, url, body, idempotent)
+            finally:
+                http.flights.forget()
+
+    async def _request(self, http, method, url, body, idempotent):
+        import aiohttp
+        attempt = 0
+        while True:
+            http.breaker.check()
+            with phase('ratelimit'):
+                await asyncio.sleep(http.limiter.reserve())
+            try:
+                with phase('network'):
+                    async with (await self.session()).request(method, url, json=body, timeout=aiohttp.ClientTimeout(total=http.timeout)) as response:
+                        delay = http.backoff(attempt, response.status, retry_after(response.headers), idempotent)
+                        if delay is None:
+                            with phase('parse'):
+                                if response.status < 400:
+                                    return check_success(await response.json(content_type=None))
+                                errmsg = error_message(response.status, await response.text())
+                            raise VastException(f'failed with error {response.status}: {errmsg}')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                delay = http.backoff(attempt, None, idempotent = idempotent)
+                if delay is None:
+                    raise
+            with phase('backoff'):
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    async def instances(self, urls = True):
+        '''The stats on the machines the user is renting. See Vast.instances.'''
+        result = (await self.request('GET', '/instances', query = {'owner': 'me'}))['instances']
+        return add_urls(result) if urls else result
+
+    async def poll(self, max_age = 0):
+        '''
+        Updates the shared Poller if its rows are older than max_age, returning them by id.
+        Polls in a thread, so that it shares fetches with synchronous callers, and subscribers
+        are not run on the event loop.
+        '''
+        return await asyncio.to_thread(self.vast.poller.poll, max_age)
+
+    async def offers(self, instance_type = 'on-demand', bundling = True, pricing_storage_GiB = 5.0, sort = ('score-',), query = 'external=false rentable=true verified=true'):
+        '''Search for instance types using custom query. See Vast.offers.'''
+        return (await self.request('GET', '/bundles', query = offers_query(instance_type, bundling, pricing_storage_GiB, sort, query)))['offers']
+
+    async def create(self, offer_id, image, **kwparams):
+        '''Create a new instance. Takes the same arguments as Vast.create.'''
+        return (await self.request('PUT', f'/asks/{offer_id}/', body = create_body(image, **kwparams), idempotent = False))['new_contract']
+
+    async def destroy(self, instance_id):
+        '''Destroy an instance (irreversible, deletes data)'''
+        await self.request('DELETE', f'/instances/{instance_id}/', body = {})
+
+    async def start(self, instance_id):
+        '''Start a stopped instance'''
+        await self.request('PUT', f'/instances/{instance_id}/', body = {'state': 'running'})
+
+    async def stop(self, instance_id):
+        '''Stop a running instance'''
+        await self.request('PUT', f'/instances/{instance_id}/', body = {'state': 'stopped'})
+
+    async def label(self, instance_id, label):
+        '''Assign a string label to an instance'''
+        await self.request('PUT', f'/instances/{instance_id}/', body = {'label': label})
+
+    async def change_bid(self, instance_id, price = None):
+        '''Change the bid price for a spot/interruptible instance'''
+        await self.request('PUT', f'/instances/bid_price/{instance_id}/', body = {'client_id': 'me', 'price': price})
+
+    async def docker_tags(self, image):
+        '''The tags of a docker image repo, sharing the wrapped Vast's tags_cache.'''
+        tags = self.vast.tags_cache.get(image)
+        if tags is self.vast.tags_cache.missing:
+            tags = await self.request('GET', '/docker/tags/', query = {'repo': image})
+            self.vast.tags_cache.set(image, tags)
+        return tags
@@ -0,0 +1,137 @@
+'''
+Measures this library's overhead against a local MockVast, without a Vast account.
+
+    python -m vast.benchmark [--sizes 1 10 100 1000] [--latency 0.01]
+'''
+from . import Vast, Fleet
+from .mock import MockVast
+from .poller import PollSchedule
+from .state import InstanceState
+from .vast import add_urls
+
+import argparse, concurrent.futures, logging, random, subprocess, sys, time, tracemalloc
+
+# fast enough that the mock's timings, not the schedule, dominate
+schedule = PollSchedule({'connecting': (0.05, 0.2), 'loading': (0.1, 0.5)}, default = (0.1, 0.5))
+
+def mock_vast(mock, **kwparams):
+    '''A Vast for a mock, without client-side rate limiting.'''
+    return Vast(url = mock.url, key = 'mock', rate = 1e9, burst = 1e9, **kwparams)
+
+def timed(func, n = 1):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+def bench_calls(n = 200, latency = 0):
+    '''Per-call time of Vast.instances via the native path and Vast.cmd, against a bare http GET.'''
+    results = {}
+    with MockVast(market_size = 10, latency = latency) as mock:
+        vast = mock_vast(mock)
+        for _ in range(3):
+            vast.instances()
+        url = vast.url_for('/instances', {'owner': 'me'})
+        results['http'] = timed(lambda: vast.session.get(url).json(), n)
+        results['native'] = timed(vast.instances, n)
+        try:
+            from . import vast_cmd
+            cmd = mock_vast(mock, native = False)
+            cmd.instances()
+            results['cmd'] = timed(cmd.instances, n)
+        except (Exception, SystemExit) as e: # argparse exits on errors
+            results['cmd'] = None
+            logging.getLogger(__name__).warning(f'Vast.cmd not measured: {e!r}')
+    return results
+
+def bench_concurrency(threads = 40, latency = 0.05):
+    '''Wall time of threads distinct concurrent reads, relative to one read.'''
+    with MockVast(market_size = 100, latency = latency) as mock:
+        vast = mock_vast(mock, pool_size = threads)
+        single = timed(lambda: vast.offers(query = 'id!=0'))
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda idx: vast.offers(query = f'id!={idx}'), range(threads)))
+            concurrent_time = time.perf_counter() - start
+    return dict(single = single, concurrent = concurrent_time, threads = threads)
+
+def bench_launch(size, latency = 0, loading_time = 0.5):
+    '''Seconds until a fleet of size instances is created, and until all are connectable.'''
+    with MockVast(market_size = size * 2, latency = latency, loading_time = loading_time) as mock:
+        vast = mock_vast(mock, pool_size = 32)
+        fleet = Fleet(vast, parallelism = 32, schedule = schedule)
+        start = time.perf_counter()
+        fleet.launch(size, wait = False)
+        created = time.perf_counter() - start
+        polls = mock.counts['GET', '/instances']
+        fleet.wait()
+        ready = time.perf_counter() - start
+        polls = mock.counts['GET', '/instances'] - polls
+        fleet.destroy()
+    return dict(created = created, ready = ready, wait_polls = polls)
+
+def bench_state(n = 10000, fields = 80, ticks = 20, churn = 0.05):
+    '''
+    Memory and per-tick time of tracking n instance rows of fields fields, as InstanceStates
+    versus the former setattr of every field with urls added, when churn of rows change per tick.
+    '''
+    class Attributes:
+        pass
+    def setattr_update(target, row):
+        for key, value in row.items():
+            setattr(target, key, value)
+    rng = random.Random(0)
+    rows = [
+        dict(id = id, machine_id = id, ssh_host = f'ssh{id % 10}.vast.ai', ssh_port = 10000 + id, actual_status = 'running',
+            status_msg = 'running', dph_total = 0.3, min_bid = 0.1, is_bid = True, start_date = time.time(),
+            **{f'field{idx}': rng.random() for idx in range(fields - 10)})
+        for id in range(n)
+    ]
+    results = {}
+    for name, make, update in (
+        ('setattr', Attributes, lambda target, row: setattr_update(target, add_urls([dict(row)])[0])),
+        ('state', InstanceState, InstanceState.update),
+    ):
+        tracemalloc.start()
+        targets = [make() for _ in range(n)]
+        for target, row in zip(targets, rows):
+            update(target, row)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for tick in range(ticks):
+            for idx in rng.sample(range(n), int(n * churn)):
+                rows[idx] = dict(rows[idx], dph_total = rng.random())
+            for target, row in zip(targets, rows):
+                update(target, row)
+        results[name] = dict(memory = memory, tick = (time.perf_counter() - start) / ticks)
+    return results
+
+def bench_import():
+    '''Seconds for a fresh interpreter to import vast, beyond starting up.'''
+    def run(code):
+        return timed(lambda: subprocess.run([sys.executable, '-c', code], check = True), 5)
+    return run('import vast') - run('pass')
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type = int, nargs = '*', default = [1, 10, 100, 1000])
+    parser.add_argument('--latency', type = float, default = 0)
+    parser.add_argument('--calls', type = int, default = 200)
+    parser.add_argument('--states', type = int, default = 10000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.ERROR)
+
+    print(f'import vast: {bench_import() * 1000:.1f} ms')
+    for path, seconds in bench_calls(args.calls, args.latency).items():
+        print(f'instances() via {path}: ' + ('n/a' if seconds is None else f'{seconds * 1e6:.0f} us/call'))
+    result = bench_concurrency()
+    print(f'{result["threads"]} concurrent reads: {result["concurrent"]:.3f}s vs {result["single"]:.3f}s for one')
+    for name, result in bench_state(args.states).items():
+        print(f'{args.states} instances as {name}: {result["memory"] / 2**20:.1f} MiB, {result["tick"] * 1000:.1f} ms per poll')
+    for size in args.sizes:
+        result = bench_launch(size, args.latency)
+        print(f'fleet of {size}: created in {result["created"]:.2f}s, ready in {result["ready"]:.2f}s with {result["wait_polls"]} instance polls')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+from . import VastException, logger
+from .retry import TokenBucket
+from .periodic import Periodic
+
+import threading, time
+
+class BidManager(Periodic):
+    '''
+    Keeps interruptible instances from staying outbid.
+
+    Every interval it reads all the account's instances from the shared Poller, and raises
+    the bid of each outbid one to its min_bid + epsilon, unless that would exceed ceiling
+    dollars per hour. Only instance_ids are managed if given, otherwise every bid instance.
+    Bid changes are limited to rate per second in bursts of up to burst, and an instance is
+    not rebid again until cooldown seconds after its last change, giving the poll time to
+    reflect it.
+
+    outbid_seconds() reports how long instances have spent outbid, and rebids, failures and
+    capped count bid changes made, failed, and withheld by the ceiling.
+    '''
+    def __init__(self, vast, ceiling = None, epsilon = 0.0001, instance_ids = None, interval = None, rate = 1, burst = 5, cooldown = None):
+        self.vast = vast
+        self.ceiling = ceiling
+        self.epsilon = epsilon
+        self.instance_ids = None if instance_ids is None else set(instance_ids)
+        super().__init__(vast.poller.interval if interval is None else interval)
+        self.limiter = TokenBucket(rate, burst)
+        self.cooldown = self.interval * 2 if cooldown is None else cooldown
+        self.rebids = 0
+        self.failures = 0
+        self.capped = 0
+        self._outbid_since = {}
+        self._outbid_total = {}
+        self._last_bid = {}
+        self._lock = threading.Lock()
+
+    def manages(self, row):
+        '''Whether a poller row is an instance this manager rebids.'''
+        return bool(row.get('is_bid')) and (self.instance_ids is None or row['id'] in self.instance_ids)
+
+    def outbid(self, row):
+        return row['min_bid'] + self.epsilon > row['dph_total']
+
+    def bid(self, row):
+        '''The bid that would win an outbid row back, or None if it is over the ceiling.'''
+        price = row['min_bid'] + self.epsilon
+        if self.ceiling is not None and price > self.ceiling:
+            return None
+        return price
+
+    def check(self, rows = None):
+        '''Rebids every managed instance that is outbid in rows, by default a fresh enough poll.'''
+        if rows is None:
+            rows = self.vast.poller.poll(self.interval / 2)
+        now = time.monotonic()
+        with self._lock:
+            for id in [id for id in self._outbid_since if id not in rows]:
+                self._end_outbid(id, now)
+            outbid = []
+            for id, row in rows.items():
+                if not self.manages(row):
+                    continue
+                if not self.outbid(row):
+                    if id in self._outbid_since:
+                        self._end_outbid(id, now)
+                    continue
+                self._outbid_since.setdefault(id, now)
+                if now - self._last_bid.get(id, -float('inf')) >= self.cooldown:
+                    outbid.append(row)
+        for row in outbid:
+            price = self.bid(row)
+            if price is None:
+                logger.warning(f'{row["id"]} outbid, but ${row["min_bid"] + self.epsilon}/h is over the ceiling of ${self.ceiling}/h')
+                self.capped += 1
+                self._last_bid[row['id']] = now
+                continue
+            if self._stopping.wait(self.limiter.reserve()):
+                return
+            logger.warning(f'{row["id"]} outbid, raising bid to ${price}/h.')
+            self._last_bid[row['id']] = time.monotonic()
+            try:
+                self.vast.change_bid(row['id'], price)
+                self.rebids += 1
+            except VastException as e:
+                logger.warning(f'{row["id"]} rebid failed: {e}')
+                self.failures += 1
+
+    def _end_outbid(self, id, now):
+        self._outbid_total[id] = self._outbid_total.get(id, 0) + now - self._outbid_since.pop(id)
+
+    def outbid_seconds(self, instance_id = None):
+        '''Seconds an instance, or all instances together, have been seen outbid, including ongoing periods.'''
+        now = time.monotonic()
+        with self._lock:
+            totals = dict(self._outbid_total)
+            for id, since in self._outbid_since.items():
+                totals[id] = totals.get(id, 0) + now - since
+        if instance_id is None:
+            return sum(totals.values())
+        return totals.get(instance_id, 0)
+
+    def stats(self):
+        with self._lock:
+            outbid_now = len(self._outbid_since)
+        return dict(rebids = self.rebids, failures = self.failures, capped = self.capped, outbid_now = outbid_now, outbid_seconds = self.outbid_seconds())
+
+    def _tick(self):
+        self.check()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
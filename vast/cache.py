@@ -0,0 +1,135 @@
+import collections, json, os, threading, time
+
+class TTLCache:
+    '''
+    A thread-safe least-recently-used mapping whose entries expire ttl seconds after being set.
+
+    If path is given, entries are loaded from and saved to that json file, so they survive
+    between processes.
+    '''
+    missing = object()
+
+    def __init__(self, maxsize = 128, ttl = 3600, path = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as reader:
+                for key, (expires, value) in json.load(reader).items():
+                    self._entries[key] = (expires, value)
+
+    def get(self, key, default = missing):
+        '''Returns the cached value for key, or default if absent or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+            self._save()
+
+    def get_or_set(self, key, compute):
+        '''Returns the cached value for key, calling compute() to fill it on a miss.'''
+        value = self.get(key)
+        if value is self.missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key = None):
+        '''Drops key, or every entry if key is None.'''
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._save()
+
+    def stats(self):
+        return dict(hits = self.hits, misses = self.misses, size = len(self._entries))
+
+    def _save(self):
+        if self.path is not None:
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as writer:
+                json.dump(self._entries, writer)
+            os.replace(tmp, self.path)
+
+class SingleFlight:
+    '''
+    Lets concurrent calls with the same key share one execution and its result or exception.
+
+    Calls arriving within fresh seconds after an execution finishes also reuse its result,
+    until forget() is called. calls counts every call, and coalesced those that did not execute.
+    '''
+    class Flight:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.finished = None
+
+    def __init__(self, fresh = 0):
+        self.fresh = fresh
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None and (flight.finished is None or time.monotonic() - flight.finished < self.fresh):
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self.Flight()
+                self._flights[key] = flight
+                leader = True
+        if leader:
+            try:
+                flight.result = func()
+            except BaseException as e:
+                flight.error = e
+            with self._lock:
+                flight.finished = time.monotonic()
+                if self._flights.get(key) is not flight:
+                    pass # forgotten while executing
+                elif self.fresh <= 0 or flight.error is not None:
+                    del self._flights[key]
+                else:
+                    self._expire()
+            flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def forget(self):
+        '''Stops later calls from reusing earlier or ongoing executions, as after a change they may not reflect.'''
+        with self._lock:
+            self._flights.clear()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, flight in self._flights.items() if flight.finished is not None and now - flight.finished >= self.fresh]:
+            del self._flights[key]
+
+    def stats(self):
+        return dict(calls = self.calls, coalesced = self.coalesced)
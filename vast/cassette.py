@@ -0,0 +1,143 @@
+from . import VastException
+from .probe import Prober
+
+import collections, gzip, json, re, requests, threading, time, urllib.parse
+
+# api keys are left out of cassettes, from urls and json bodies, so they can be shared and match under any key
+key_re = re.compile(r'([?&])api_key=[^&]*&?')
+
+def strip_key(url):
+    return key_re.sub(r'\1', url).rstrip('?&')
+
+def redact(value):
+    '''value with any api_key fields within it removed.'''
+    if type(value) is dict:
+        return {key: redact(item) for key, item in value.items() if key != 'api_key'}
+    if type(value) is list:
+        return [redact(item) for item in value]
+    return value
+
+def redact_text(text):
+    # json bodies are redacted, and left as sent unless they held a key
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    redacted = redact(value)
+    return text if redacted == value else json.dumps(redacted)
+
+def open_cassette(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't')
+    return open(path, mode)
+
+class RecordingSession:
+    '''
+    Stands in for a requests session, passing requests on to session while appending each
+    exchange and its timing to a cassette file at path, one json object per line, gzipped if
+    path ends in .gz. Pass it as Vast(session = ...) to record everything Vast and Vast.cmd
+    send, including docker_tags lookups; AsyncVast's aiohttp requests are not recorded.
+    '''
+    def __init__(self, path, session = None):
+        self.session = requests.Session() if session is None else session
+        self.path = path
+        self.started = time.time()
+        self._file = open_cassette(path, 'w')
+        self._lock = threading.Lock()
+        self._write({'version': 1, 'started': self.started})
+
+    def __getattr__(self, attr):
+        return getattr(self.session, attr)
+
+    def request(self, method, url, **kwparams):
+        start = time.time()
+        response = self.session.request(method, url, **kwparams)
+        self._write({
+            't': round(start - self.started, 6), 'elapsed': round(time.time() - start, 6),
+            'method': method, 'url': strip_key(url), 'body': redact(kwparams.get('json')),
+            'status': response.status_code, 'reason': response.reason,
+            'headers': {key: value for key, value in response.headers.items() if key in ('Content-Type', 'Retry-After')},
+            'content': redact_text(response.text),
+        })
+        return response
+
+    def _write(self, record):
+        line = json.dumps(record, separators = (',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ReplaySession:
+    '''
+    Stands in for a requests session by answering requests from a cassette written by
+    RecordingSession, without a network or an account.
+
+    Each request gets the next recorded response to the same method, url and body, in
+    recorded order, and the last one again once they run out, so that polling continues
+    past the end of the recording. Responses are delayed by their recorded latency divided
+    by speed, or not at all if speed is None. Requests are matched by path and query, so
+    the server may differ from the recording's as long as its url has the same path. Requests never recorded raise VastException.
+    '''
+    def __init__(self, path, speed = None):
+        self.path = path
+        self.speed = speed
+        self.adapters = {}
+        self.replayed = 0
+        self._exchanges = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        with open_cassette(path, 'r') as reader:
+            for line in reader:
+                record = json.loads(line)
+                if 'method' in record:
+                    self._exchanges[self._key(record['method'], record['url'], record['body'])].append(record)
+
+    @staticmethod
+    def _key(method, url, body):
+        # by path, so a cassette replays against any host
+        url = urllib.parse.urlsplit(strip_key(url))
+        return method, url.path + ('?' + url.query if url.query else ''), json.dumps(redact(body), sort_keys = True)
+
+    def request(self, method, url, **kwparams):
+        key = self._key(method, url, kwparams.get('json'))
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise VastException(f'{method} {strip_key(url)} not in cassette {self.path}')
+            record = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+            self.replayed += 1
+        if self.speed is not None:
+            time.sleep(record['elapsed'] / self.speed)
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record['reason']
+        response.headers.update(record['headers'])
+        response._content = record['content'].encode()
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+    def close(self):
+        pass
+
+class ReplayProber(Prober):
+    '''
+    Reports every endpoint with an address as connectable, as ssh probes are not recorded in
+    cassettes and the recorded hosts are rarely reachable when replaying. Assign it to
+    vast.prober when replaying Instance.wait.
+    '''
+    def probe(self, host, port, key = None):
+        return host is not None and port is not None and self._record(host, port, key, True, 0)
+
+    async def aprobe(self, host, port, key = None):
+        return self.probe(host, port, key)
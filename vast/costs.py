@@ -0,0 +1,190 @@
+from . import logger
+from .periodic import Periodic
+
+import collections, heapq, json, threading, time, weakref
+
+class CostTracker(Periodic):
+    '''
+    Estimates live spend by integrating each instance's dph_total over time from the shared
+    Poller, billing an instance from its start_date while its intended status is running.
+
+    Spend is kept per instance id, per named group of instances, and in total under None, each
+    as a linear function of time that only changes when a poll shows a row change, so a
+    tick costs O(changes) however many instances there are. Budgets on any of these keys
+    run their action, by default destroying the instances under them, once spend reaches
+    the limit; their deadlines are kept in a heap, so checking them is also O(changes).
+
+    ingest_invoices() reads only invoice rows newer than the last ones seen into invoices,
+    adding their amounts to charged. The api has no cursor, so the response itself still
+    holds the whole history.
+
+    start() polls every interval, and ingests invoices every invoice_interval, in a thread.
+    '''
+    def __init__(self, vast, interval = None, invoice_interval = 3600):
+        self.vast = vast
+        super().__init__(vast.poller.interval if interval is None else interval)
+        self.invoice_interval = invoice_interval
+        self.invoices = []
+        self.charged = 0.0
+        self.current = None
+        self._ingested = float('-inf') # when invoices were last ingested, by time.monotonic()
+        self._cursor = (None, set()) # latest invoice timestamp, and the keys of rows at it
+        self._rates = {} # instance id -> dollars per second
+        self._sums = collections.defaultdict(lambda: [0.0, 0.0]) # key -> [offset, rate]; spend at t is offset + rate * t
+        self._groups = collections.defaultdict(set) # instance id -> group names
+        self._members = collections.defaultdict(set) # group name -> instance ids
+        self._instances = weakref.WeakValueDictionary() # instance id -> Instance given to group
+        self._budgets = {} # key -> (limit, action)
+        self._deadlines = [] # heap of (time, version, key)
+        self._versions = collections.Counter()
+        self._lock = threading.RLock()
+        vast.poller.subscribe(None, self.update)
+        for id, row in vast.poller.rows.items():
+            self.update(id, row)
+
+    def update(self, instance_id, row, now = None):
+        '''Applies a changed Poller row, or None for a vanished instance, to the spend rates.'''
+        now = time.time() if now is None else now
+        rate = row['dph_total'] / 3600 if row is not None and row.get('intended_status') == 'running' else 0.0
+        with self._lock:
+            old = self._rates.get(instance_id)
+            if old is None:
+                if row is None:
+                    return
+                # first sighting: bill from when the instance started
+                self._rates[instance_id] = 0.0
+                self._apply(instance_id, 0.0, rate, row.get('start_date') or now)
+            elif old != rate:
+                self._apply(instance_id, old, rate, now)
+            if row is None:
+                self._rates.pop(instance_id)
+
+    def _apply(self, instance_id, old, rate, now):
+        # changes an instance's rate from old at time now, in every sum containing it
+        self._rates[instance_id] = rate
+        for key in (instance_id, None, *self._groups[instance_id]):
+            sums = self._sums[key]
+            sums[0] += (old - rate) * now
+            sums[1] += rate - old
+            if key in self._budgets:
+                self._schedule(key)
+
+    def group(self, name, instance_ids):
+        '''
+        Adds instances to the named group, such as a fleet, summing their spend so far into it.
+        instance_ids may hold Instances, which budgets then destroy through Instance.destroy.
+        '''
+        with self._lock:
+            sums = self._sums[name]
+            for instance_id in instance_ids:
+                if hasattr(instance_id, 'id'):
+                    instance, instance_id = instance_id, instance_id.id
+                    self._instances[instance_id] = instance
+                if name in self._groups[instance_id]:
+                    continue
+                self._groups[instance_id].add(name)
+                self._members[name].add(instance_id)
+                offset, rate = self._sums[instance_id]
+                sums[0] += offset
+                sums[1] += rate
+            if name in self._budgets:
+                self._schedule(name)
+
+    def spend(self, key = None, now = None):
+        '''Estimated dollars spent by an instance id, a group name, or in total for None.'''
+        now = time.time() if now is None else now
+        with self._lock:
+            offset, rate = self._sums.get(key, (0.0, 0.0))
+        return offset + rate * now
+
+    def rate(self, key = None):
+        '''Current dollars per hour of an instance id, a group name, or in total for None.'''
+        with self._lock:
+            return self._sums.get(key, (0.0, 0.0))[1] * 3600
+
+    def budget(self, key, limit, action = None):
+        '''
+        Calls action(key) once the spend of key reaches limit dollars. By default the action
+        destroys every instance under key.
+        '''
+        with self._lock:
+            self._budgets[key] = (limit, self.destroy if action is None else action)
+            self._schedule(key)
+
+    def destroy(self, key):
+        with self._lock:
+            if key is None:
+                ids = list(self._rates)
+            elif key in self._members:
+                ids = list(self._members[key])
+            else:
+                ids = [key]
+            instances = {id: (self._instances.get(id),) for id in ids if id in self._rates}
+        logger.warning(f'budget for {key} reached, destroying {len(ids)} instances')
+        return self.vast.bulk(self._destroy, instances)
+
+    def _destroy(self, instance_id, instance):
+        # an Instance still holding the id clears it, so it is not destroyed again later
+        if instance is not None and instance.id == instance_id:
+            instance.destroy()
+        else:
+            self.vast.destroy(instance_id)
+
+    def _schedule(self, key):
+        # pushes when the budget of key will run out at its current rate
+        offset, rate = self._sums[key]
+        limit, action = self._budgets[key]
+        self._versions[key] += 1
+        due = float('-inf') if offset >= limit else (limit - offset) / rate if rate > 0 else float('inf')
+        if due != float('inf'):
+            heapq.heappush(self._deadlines, (due, self._versions[key], key))
+
+    def check(self, now = None):
+        '''Runs the actions of budgets whose spend has reached their limit.'''
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, version, key = heapq.heappop(self._deadlines)
+                if version == self._versions[key] and key in self._budgets:
+                    due.append((key, self._budgets.pop(key)[1]))
+        for key, action in due:
+            try:
+                action(key)
+            except Exception as e:
+                logger.exception(e)
+        return [key for key, action in due]
+
+    def ingest_invoices(self):
+        '''Adds invoice rows newer than the last ingested ones, returning them.'''
+        history, self.current = self.vast.invoices()
+        latest, seen = self._cursor
+        new = [
+            row for row in history
+            if latest is None or (row['timestamp'] or 0) > latest
+                or ((row['timestamp'] or 0) == latest and invoice_key(row) not in seen)
+        ]
+        if new:
+            newest = max(row['timestamp'] or 0 for row in new)
+            if newest != latest:
+                latest, seen = newest, set()
+            seen.update(invoice_key(row) for row in new if (row['timestamp'] or 0) == latest)
+            self._cursor = (latest, seen)
+        self.charged += sum(float(row['amount']) for row in new if row.get('type') == 'charge')
+        self.invoices.extend(new)
+        return new
+
+    def _tick(self):
+        self.vast.poller.poll(self.interval / 2)
+        self.check()
+        if self.invoice_interval is not None and time.monotonic() - self._ingested >= self.invoice_interval:
+            self._ingested = time.monotonic()
+            self.ingest_invoices()
+
+    def close(self):
+        self.stop()
+        self.vast.poller.unsubscribe(None, self.update)
+
+def invoice_key(row):
+    # invoice rows carry no guaranteed id, so rows sharing a timestamp are told apart by content
+    return json.dumps(row, sort_keys=True, default=str)
@@ -0,0 +1,113 @@
+from . import logger
+from .periodic import Periodic
+
+import collections, threading, time
+
+Event = collections.namedtuple('Event', ('kind', 'instance_id', 'row', 'time'))
+Event.__doc__ = '''A lifecycle transition of an instance, with its latest Poller row, or None once destroyed.'''
+
+class LifecycleEvents(Periodic):
+    '''
+    Publishes lifecycle events for every instance on the account from the shared Poller,
+    so one thread can follow thousands of instances instead of one blocked in each
+    Instance.wait.
+
+    Event kinds are:
+        created      an instance is first seen
+        loading      its actual_status becomes loading
+        running      its actual_status becomes running
+        connectable  it is running and accepts ssh, probed concurrently each tick
+        outbid       it becomes outbid
+        error        its status_msg reports an error
+        destroyed    it disappears
+    Callbacks are called with an Event on the polling thread, and should not block it.
+    Instances the Poller already knows of when this is constructed are taken as they are,
+    without events.
+    '''
+    kinds = ('created', 'loading', 'running', 'connectable', 'outbid', 'error', 'destroyed')
+
+    def __init__(self, vast, interval = None):
+        self.vast = vast
+        super().__init__(vast.poller.interval if interval is None else interval)
+        self._subscribers = collections.defaultdict(list)
+        self._states = {} # instance id -> (actual_status, status_msg, outbid)
+        self._connecting = {} # running instance id -> (ssh_host, ssh_port)
+        self._lock = threading.Lock()
+        vast.poller.subscribe(None, self._changed)
+        for id, row in vast.poller.rows.items():
+            self._states[id] = self._state(row)
+
+    def subscribe(self, kind, callback):
+        '''Calls callback(event) for each event of kind, or of every kind if kind is None.'''
+        assert kind is None or kind in self.kinds
+        self._subscribers[kind].append(callback)
+
+    def unsubscribe(self, kind, callback):
+        callbacks = self._subscribers.get(kind, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _emit(self, kind, instance_id, row):
+        event = Event(kind, instance_id, row, time.time())
+        logger.debug(f'{instance_id}: {kind}')
+        for callback in [*self._subscribers.get(kind, ()), *self._subscribers.get(None, ())]:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.exception(e)
+
+    @staticmethod
+    def _state(row):
+        status, status_msg = row.get('actual_status'), row.get('status_msg') or ''
+        return status, status_msg, bool(row.get('is_bid')) and row['min_bid'] + 0.0001 > row['dph_total']
+
+    def _changed(self, instance_id, row):
+        with self._lock:
+            previous = self._states.pop(instance_id, None)
+            if row is None:
+                self._connecting.pop(instance_id, None)
+            else:
+                status, status_msg, outbid = self._states[instance_id] = self._state(row)
+                if status == 'running' and (previous is None or previous[0] != 'running' or instance_id in self._connecting):
+                    self._connecting[instance_id] = (row.get('ssh_host'), row.get('ssh_port'))
+                elif status != 'running':
+                    self._connecting.pop(instance_id, None)
+        if row is None:
+            if previous is not None:
+                self._emit('destroyed', instance_id, None)
+            return
+        if previous is None:
+            self._emit('created', instance_id, row)
+            previous = (None, '', False)
+        if status != previous[0] and status in ('loading', 'running'):
+            self._emit(status, instance_id, row)
+        if 'Error' in status_msg and status_msg != previous[1]: # as Instance treats it
+            self._emit('error', instance_id, row)
+        if outbid and not previous[2]:
+            self._emit('outbid', instance_id, row)
+
+    def tick(self):
+        '''Polls if the shared rows are older than interval, emitting events, and probes running instances for ssh.'''
+        self.vast.poller.poll(self.interval / 2)
+        with self._lock:
+            endpoints = dict(self._connecting)
+        if endpoints:
+            for instance_id, connectable in self.vast.prober.probe_many(endpoints).items():
+                if connectable:
+                    with self._lock:
+                        connected = self._connecting.pop(instance_id, None) is not None
+                    if connected:
+                        self._emit('connectable', instance_id, self.vast.poller.find(instance_id))
+
+    def _tick(self):
+        self.tick()
+
+    def close(self):
+        self.stop()
+        self.vast.poller.unsubscribe(None, self._changed)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,84 @@
+from . import Vast, VastException, logger
+from .instance import Instance
+
+import concurrent.futures, threading, time
+
+# errors from create meaning the offer was rented by someone else first, as opposed to a
+# problem with the account, image or api that every other offer would hit too
+lost_offer_errors = ('no_such_ask',)
+
+class Fleet:
+    '''
+    A group of Instances provisioned and waited on together.
+
+    Keyword parameters not consumed by Fleet are passed on to each Instance.
+    '''
+    def __init__(self, vast = None, parallelism = 8, api_key = None, **instance_kwparams):
+        if vast is None:
+            vast = Vast(key = api_key)
+        self.vast = vast
+        self.parallelism = parallelism
+        self.instances = []
+        self._instance_kwparams = instance_kwparams
+
+    def launch(self, n, query = None, sort = None, price = None, wait = True):
+        '''
+        Rents n instances from a single offers search, each on a distinct offer.
+
+        Creation runs with up to parallelism calls at once. When an offer is lost to another
+        renter the next one down the sorted list is tried; other errors are raised. If wait is True, blocks until all the
+        new instances are connectable.
+        '''
+        start = time.time()
+        offers = iter(Instance(vast = self.vast, **self._instance_kwparams).offers(query, sort))
+        offers_lock = threading.Lock()
+
+        def launch_one():
+            while True:
+                with offers_lock:
+                    offer = next(offers, None)
+                if offer is None:
+                    return None
+                instance = Instance(vast = self.vast, **self._instance_kwparams)
+                try:
+                    instance.create(price, offer)
+                except VastException as e:
+                    if instance.created or not any(error in str(e) for error in lost_offer_errors):
+                        raise
+                    logger.warning(f'offer {offer["id"]} lost: {e}')
+                    continue
+                return instance
+
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            futures = [pool.submit(launch_one) for _ in range(n)]
+        launched = [future.result() for future in futures if not future.exception() and future.result() is not None]
+        self.instances.extend(launched)
+        logger.info(f'created {len(launched)} instances in {time.time() - start}s')
+
+        for future in futures:
+            if future.exception():
+                raise future.exception()
+        if len(launched) < n:
+            raise VastException(f'only {len(launched)} of {n} instances could be created')
+        if wait:
+            self.wait(launched)
+            logger.info(f'{len(launched)} instances ready in {time.time() - start}s')
+        return launched
+
+    def wait(self, instances = None, for_status = None):
+        '''
+        Waits on up to parallelism instances at a time, raising the first error after all have
+        finished. They share polls, and ready instances return at once, so one slow instance
+        only holds up its own thread.
+        '''
+        if instances is None:
+            instances = self.instances
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            futures = [pool.submit(instance.wait, for_status) for instance in instances]
+        for future in futures:
+            future.result()
+
+    def destroy(self):
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            list(pool.map(Instance.destroy, self.instances))
+        self.instances = []
@@ -0,0 +1,69 @@
+from . import logger
+from .vast import BulkResult
+
+import time
+
+# list_machine parameters, and the machines() fields reporting their current values
+listing_fields = {
+    'price_gpu': 'listed_gpu_cost', 'price_disk': 'listed_storage_cost', 'price_inetu': 'listed_inet_up_cost',
+    'price_inetd': 'listed_inet_down_cost', 'min_chunk': 'listed_min_gpu_count', 'end_timestamp': 'end_date',
+}
+
+class HostManager:
+    '''
+    Applies pricing plans to many hosted machines at once.
+
+    A plan maps machine ids to dicts of list_machine parameters, plus optionally min_bid for
+    set_min_bid and listed=False to unlist. Machines are fetched once and compared against
+    the plan, so only machines whose listing differs are relisted, and only changed min
+    bids are set. Fields the api does not report are assumed to differ. Changes are made with
+    up to parallelism machines at once through Vast.bulk.
+    '''
+    def __init__(self, vast, parallelism = 8):
+        self.vast = vast
+        self.parallelism = parallelism
+
+    def diff(self, plan, machines = None):
+        '''Returns {machine_id: [(method name, kwparams)]} of the calls needed to reach plan.'''
+        if machines is None:
+            machines = self.vast.machines()
+        machines = {machine['id']: machine for machine in machines}
+        calls = {}
+        for machine_id, wanted in plan.items():
+            current = machines.get(machine_id, {})
+            wanted = dict(wanted)
+            min_bid = wanted.pop('min_bid', None)
+            listed = wanted.pop('listed', True)
+            calls[machine_id] = []
+            if not listed:
+                if current.get('listed', True):
+                    calls[machine_id].append(('unlist_machine', {}))
+                continue
+            if not current.get('listed') or any(
+                listing_fields.get(key) not in current or current[listing_fields[key]] != value
+                for key, value in wanted.items()
+            ):
+                calls[machine_id].append(('list_machine', wanted))
+            if min_bid is not None and current.get('min_bid_price') != min_bid:
+                calls[machine_id].append(('set_min_bid', {'price': min_bid}))
+        return calls
+
+    def apply(self, plan, machines = None):
+        '''
+        Makes the calls needed to reach plan concurrently, returning a BulkResult of the
+        method names called for each machine, and the total time including the fetch.
+        '''
+        start = time.monotonic()
+        calls = self.diff(plan, machines)
+        changed = {machine_id: (machine_calls,) for machine_id, machine_calls in calls.items() if machine_calls}
+        logger.info(f'{len(changed)} of {len(plan)} machines need changes')
+        result = self.vast.bulk(self.apply_machine, changed, self.parallelism)
+        results = {machine_id: [] for machine_id in calls if machine_id not in result.errors}
+        results.update(result.results)
+        return BulkResult(results, result.errors, time.monotonic() - start)
+
+    def apply_machine(self, machine_id, calls):
+        '''Makes diff's calls for one machine in order, returning their method names.'''
+        for method, kwparams in calls:
+            getattr(self.vast, method)(machine_id, **kwparams)
+        return [method for method, kwparams in calls]
@@ -1,35 +1,71 @@
 from . import Vast, VastException, logger
+from .poller import PollSchedule
+from .state import InstanceState
 
-import asyncio, io, socket, time
+import asyncio, io, time
 
 class Instance:
     # to blacklist machines add machine_id!=<machine_id> to query
-    def __init__(self, instance_id = None, machine_id = None, vast = None, query = 'inet_down>=200', sort = 'dph_total', api_key = None, instance_type = 'interruptible', GiB = 5.0, image = 'pytorch/pytorch:latest'):#, rebid = True):
+    def __init__(self, instance_id = None, machine_id = None, vast = None, query = 'inet_down>=200', sort = 'dph_total', api_key = None, instance_type = 'interruptible', GiB = 5.0, image = 'pytorch/pytorch:latest', schedule = None, bids = None):
         if vast is None:
             vast = Vast(key = api_key)
         
         self.vast = vast
+        self.state = InstanceState() # the api's fields, also readable as attributes of the Instance
         self.machine_id = machine_id
         self.id = instance_id
-        #self.rebid = rebid
+        self.bids = bids # a BidManager that wait rebids through when outbid, rather than raising
         self._query = query
         self._sort = sort
         self._instance_type = instance_type
         self._GiB = GiB
         self._image = image
+        self.schedule = PollSchedule() if schedule is None else schedule
+        self.phase_times = {} # seconds spent waiting in each phase
+        self._phase = None
 
         if self.id is not None or self.machine_id is not None:
-            instances = self.vast.instances()
+            poller = self.vast.poller
+            # rows hydrated from a store serve until the next poll reconciles them
+            hydrated = self.vast.store is not None and poller.find(self.id, self.machine_id) is not None
+            instances = list((poller.rows if hydrated else poller.poll(poller.interval)).values())
             if self.id is not None and self.id < len(instances) and self.machine_id is None:
                 self.id = instances[0]['id']
                 self.machine_id = instances[0]['machine_id']
             else:
                 assert [instance for instance in instances if instance['id'] == self.id or instance['machine_id'] == self.machine_id]
             self._detached = True
-            self.update_attributes()
+            self.update_attributes(float('inf') if hydrated else poller.interval)
         else:
             self._detached = False
 
+    @classmethod
+    def restore(cls, vast, reconcile = True, **kwparams):
+        '''
+        Recreates the Instances this controller created before restarting, from vast.store.
+        If reconcile is True, first polls once, forgetting instances that have since gone.
+        '''
+        poller = vast.poller
+        if reconcile:
+            poller.poll()
+        instances = []
+        for instance_id, offer in vast.store.owned().items():
+            row = poller.find(instance_id)
+            if row is None:
+                if reconcile:
+                    vast.store.disown(instance_id)
+                continue
+            instance = cls(instance_id = instance_id, machine_id = row['machine_id'], vast = vast, **kwparams)
+            instance.offer = offer
+            instance._detached = False
+            instances.append(instance)
+        return instances
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'state':
+            raise AttributeError(name)
+        return getattr(self.state, name)
+
     @property
     def created(self):
         return self.id is not None
@@ -40,15 +76,12 @@ class Instance:
 
     @property
     def connectable(self):
-        # probe port
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            result = sock.connect_ex((self.ssh_host, self.ssh_port))
-            return result == 0
-        except:
-            return False
-        finally:
-            sock.close()
+        # probe port, with the timeout and caching of the shared prober
+        return self.vast.prober.probe(self.ssh_host, self.ssh_port, self.id)
+
+    async def aconnectable(self):
+        # probe port without blocking the event loop
+        return await self.vast.prober.aprobe(self.ssh_host, self.ssh_port, self.id)
 
     #def invoke_run(self, connection, *params, **kwparams):
     #    io.BufferedRWPair(
@@ -70,35 +103,53 @@ class Instance:
     #    finally:
     #        self.destroy()
 
-    def update_attributes(self):
+    def update_attributes(self, max_age = 0):
+        # fetches fresh fields unless the shared rows are newer than max_age seconds
         if self.created:
-            attrs = [instance for instance in self.vast.instances() if instance['machine_id'] == self.machine_id or instance['id'] == self.id][0]
-            if attrs['actual_status'] is None:
-                attrs['actual_status'] = 'initializing'
-            if attrs['status_msg'] is None:
-                attrs['status_msg'] = attrs['actual_status'].title() + '...'
-            attrs['status_msg'] = attrs['status_msg'].strip()
-            if not hasattr(self, 'status_msg') or attrs['status_msg'] != self.status_msg or attrs['actual_status'] != self.actual_status:
-                
-                status_msg = attrs['status_msg']
-                logmsg = f'{attrs["machine_id"]}: {attrs["actual_status"]}->{attrs["next_state"]}: {status_msg}'
-                if 'Error' in status_msg: # note it also displays package names containing the word 'error'
-                    logger.error(logmsg)
-                    raise VastException(status_msg)
-                else:
-                    logger.info(logmsg)
-            for key, value in attrs.items():
-                setattr(self, key, value)
-            self.outbid = self.min_bid + 0.0001 > self.dph_total and self.is_bid
-            self.max_cost = self.dph_total / 3600 * (time.time() - self.start_date)
-            return attrs
+            return self._apply(self.vast.poller.row(self.id, self.machine_id, max_age))
         else:
             return None
 
+    async def aupdate_attributes(self, max_age = 0):
+        if self.created:
+            poller = self.vast.poller
+            await self.vast.avast.poll(max_age)
+            row = poller.find(self.id, self.machine_id)
+            if row is None:
+                # may be newly created
+                await self.vast.avast.poll()
+                row = poller.find(self.id, self.machine_id)
+            return self._apply(row)
+        else:
+            return None
+
+    def _apply(self, row):
+        # returns the fields that changed
+        if row is None:
+            raise VastException(f'{self.id}: instance not found')
+        actual_status = row['actual_status'] or 'initializing'
+        status_msg = (row['status_msg'] or actual_status.title() + '...').strip()
+        if status_msg != self.state.get('status_msg') or actual_status != self.state.get('actual_status'):
+            logmsg = f'{row["machine_id"]}: {actual_status}->{row["next_state"]}: {status_msg}'
+            if 'Error' in status_msg: # note it also displays package names containing the word 'error'
+                logger.error(logmsg)
+                raise VastException(status_msg)
+            else:
+                logger.info(logmsg)
+        self.machine_id = row['machine_id']
+        return self.state.update(row, actual_status = actual_status, status_msg = status_msg)
+
     @property
     def docker_tags(self):
         image, *version = self._image.split(':',1)
-        tags = self.vast.docker_tags(image)
+        return self._select_tags(self.vast.docker_tags(image), version)
+
+    async def adocker_tags(self):
+        image, *version = self._image.split(':',1)
+        return self._select_tags(await self.vast.avast.docker_tags(image), version)
+
+    @staticmethod
+    def _select_tags(tags, version):
         if not version:
             return tags[0]
         tags = { version_tags['name']: version_tags for version_tags in tags }
@@ -106,7 +157,13 @@ class Instance:
 
     @property
     def compatibility_query(self):
-        tags = self.docker_tags
+        return self._compatibility_query(self.docker_tags)
+
+    async def acompatibility_query(self):
+        return self._compatibility_query(await self.adocker_tags())
+
+    @staticmethod
+    def _compatibility_query(tags):
         query = ['rentable=true']
         min_cuda = tags.get('min_cuda')
         if min_cuda:
@@ -120,13 +177,36 @@ class Instance:
                 query.append(f'{prop} {op} {value}')
         return ' '.join(query)
 
+    def offers(self, query = None, sort = None):
+        '''Searches for offers compatible with this instance's image, defaulting to its query and sort.'''
+        query = self.compatibility_query + ' ' + (self._query if query is None else query)
+        return self.vast.offers(self._instance_type, pricing_storage_GiB = self._GiB, sort = self._sort if sort is None else sort, query = query)
+
     def create(self, price = None, offer = None):
         assert self.id is None
         if offer is None:
-            query = self.compatibility_query + ' ' + self._query
-            self.offer = self.vast.offers(self._instance_type, pricing_storage_GiB = self._GiB, sort = self._sort, query = query)[0]
-        else:
-            self.offer = offer
+            offer = self.offers()[0]
+        price = self._use_offer(offer, price)
+        self.id = self.vast.create(self.offer['id'], disk_GB=self._GiB, image=self._image, price=price)
+        self._own()
+        return self.update_attributes()
+
+    async def acreate(self, price = None, offer = None):
+        assert self.id is None
+        if offer is None:
+            query = await self.acompatibility_query() + ' ' + self._query
+            offer = (await self.vast.avast.offers(self._instance_type, pricing_storage_GiB = self._GiB, sort = self._sort, query = query))[0]
+        price = self._use_offer(offer, price)
+        self.id = await self.vast.avast.create(self.offer['id'], disk_GB=self._GiB, image=self._image, price=price)
+        self._own()
+        changes = await self.aupdate_attributes()
+        await self._await_or_destroy()
+        return changes
+
+    def _use_offer(self, offer, price):
+        self.__dict__.pop('max_cost', None) # left by a previous destroy
+        self.state = InstanceState()
+        self.offer = offer
         self.machine_id = self.offer['machine_id']
         if self._instance_type == 'on-demand':
             price = None
@@ -134,17 +214,31 @@ class Instance:
             if price is None:
                 #price = selef.vast.offer_bid_price(self.offer['id'])
                 price = self.offer['min_bid'] + 0.0001
-        self.id = self.vast.create(self.offer['id'], disk_GB=self._GiB, image=self._image, price=price)
-        return self.update_attributes()
+        return price
 
     def destroy(self):
         if self.id is not None:
             self.vast.destroy(self.id)
-            self.end_time = time.time()
-            hours = (self.end_time - self.start_date) / 3600
-            self.max_cost = self.dph_total * hours
-            logger.warning(f'{self.id} max cost was ${round(self.max_cost*100) / 100} for {hours}h')
-            self.id = None
+            self._destroyed()
+
+    async def adestroy(self):
+        if self.id is not None:
+            await self.vast.avast.destroy(self.id)
+            self._destroyed()
+
+    def _own(self):
+        # records the new instance as this controller's, so it outlives a restart
+        if self.vast.store is not None:
+            self.vast.store.own(self.id, self.offer)
+
+    def _destroyed(self):
+        if self.vast.store is not None:
+            self.vast.store.disown(self.id)
+        self.end_time = time.time()
+        hours = (self.end_time - self.start_date) / 3600
+        self.max_cost = self.dph_total * hours
+        logger.warning(f'{self.id} max cost was ${round(self.max_cost*100) / 100} for {hours}h')
+        self.id = None
 
     def start(self):
         if not self.created:
@@ -156,70 +250,131 @@ class Instance:
         self.vast.stop(self.id)
         self.update_attributes()
 
-    def wait(self, for_status = None):
+    async def astart(self):
+        if not self.created:
+            return await self.acreate()
+        await self.vast.avast.start(self.id)
+        await self.aupdate_attributes()
+        await self._await_or_destroy()
+
+    async def astop(self):
+        await self.vast.avast.stop(self.id)
+        await self.aupdate_attributes()
+        await self.async_wait()
+
+    def wait(self, for_status = None, timeout = None, deadline = None):
+        '''
+        Polls until the instance reaches for_status, or its intended status, and accepts ssh
+        if running. Intervals follow self.schedule. Raises VastException after timeout seconds
+        or at the time.time() deadline. Returns the fields that changed while waiting.
+        '''
         if not self.created:
             return
-        attrs = None
-        while (
-                ((for_status is None and self.actual_status != self.intended_status)
-                    or (for_status is not None and self.actual_status != for_status)
-                    or (self.actual_status == 'running' and not self.connectable)
-                )
-                and self.created 
-        ):
-            time.sleep(4)
-            attrs = self.update_attributes()
-            if self.outbid:
-                #if self.rebid:
-                #    new_bid = self.min_bid + 0.0001
-                #    logger.warning(f'Outbid, raising bid to ${new_bid}/h.')
-                #    self.vast.change_bid(self.id, new_bid)
-                #else:
-                    raise VastException('outbid')
-        return attrs
+        deadline = self._deadline(timeout, deadline)
+        changes = {}
+        try:
+            while self.created:
+                connecting = self.actual_status == 'running' and not self.connectable
+                delay = self._next_delay(for_status, connecting, deadline)
+                if delay is None:
+                    break
+                self.vast.poller.wait(self.id, delay)
+                changes.update(self.update_attributes(delay))
+                if self._outbid():
+                    if not self._rebiddable():
+                        raise VastException('outbid')
+                    self.bids.check()
+        finally:
+            self._time_phase(None)
+        return changes
+
+    def _outbid(self):
+        # by the margin of self.bids if it manages this instance, so a rebid it considers won is not still outbid
+        row = self.vast.poller.find(self.id)
+        if self.bids is not None and row is not None and self.bids.manages(row):
+            return self.bids.outbid(row)
+        return self.outbid
+
+    def _rebiddable(self):
+        # whether self.bids will raise the bid of this instance
+        row = self.vast.poller.find(self.id)
+        return self.bids is not None and row is not None and self.bids.manages(row) and self.bids.bid(row) is not None
+
+    @staticmethod
+    def _deadline(timeout, deadline):
+        if timeout is not None:
+            deadline = min(time.time() + timeout, float('inf') if deadline is None else deadline)
+        return deadline
+
+    def _next_delay(self, for_status, connecting, deadline):
+        # returns how long to wait before polling again, or None if done waiting
+        phase = 'connecting' if connecting else self.actual_status
+        polls = self._time_phase(phase)
+        wanted = self.intended_status if for_status is None else for_status
+        # the api reports stopped instances as exited
+        if (self.actual_status == wanted or (wanted == 'stopped' and self.actual_status == 'exited')) and not connecting:
+            return None
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            raise VastException(f'{self.id}: timed out while {phase}')
+        delay = self.schedule.delay(phase, polls)
+        if deadline is not None:
+            delay = min(delay, deadline - now)
+        return delay
+
+    def _time_phase(self, phase):
+        # adds the time since the last call to the current phase, returning how many polls it has lasted
+        now = time.monotonic()
+        if self._phase is not None:
+            self.phase_times[self._phase] = self.phase_times.get(self._phase, 0) + now - self._phase_start
+            if phase == self._phase:
+                self._phase_start = now
+                self._phase_polls += 1
+                return self._phase_polls
+            logger.debug(f'{self.id}: {self._phase} for {self.phase_times[self._phase]}s')
+        self._phase, self._phase_start, self._phase_polls = phase, now, 0
+        return 0
 
     def upload(self, src_path, dst_path):
-        return self.vast.copy(src_path, (self.instance_id, dst_path))
+        return self.vast.copy(src_path, (self.id, dst_path))
 
     def download(self, src_path, dst_path):
-        return self.vast.copy((self.instance_id, src_path), dst_path)
+        return self.vast.copy((self.id, src_path), dst_path)
 
     def transfer(self, src_path, instance, dst_path):
         if isinstance(instance, Instance):
-            instance = instance.instance_id
-        return self.vast.copy((self.instance_id, src_path), (instance, dst_path))
+            instance = instance.id
+        return self.vast.copy((self.id, src_path), (instance, dst_path))
 
-    async def async_wait(self, for_status = None):
+    async def async_wait(self, for_status = None, timeout = None, deadline = None):
         if not self.created:
             return
-        attrs = None
-        while (
-                ((for_status is None and self.actual_status != self.intended_status)
-                    or (for_status is not None and self.actual_status != for_status)
-                    or (self.actual_status == 'running' and not self.connectable)
-                )
-                and self.created 
-        ):
-            await asyncio.sleep(4)
-            attrs = self.update_attributes()
-        return attrs
-
-    def _getattr__(self, attr):
-        if attr[0] == 'a' and hasattr(self, attr[1:]):
-            # async method equivalents starting with 'a'
-            method = getattr(self, attr[1:])
-            async def wrapper(*params, **kwparams):
-                result = method(*params, **kwparams)
-                try:
-                    await self.async_wait()
-                except:
-                    await self.destroy()
-                    raise
-                return result
-            return wrapper
-        else:
-            return super().__getattr__(attr)
+        deadline = self._deadline(timeout, deadline)
+        changes = {}
+        try:
+            while self.created:
+                connecting = self.actual_status == 'running' and not await self.aconnectable()
+                delay = self._next_delay(for_status, connecting, deadline)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                changes.update(await self.aupdate_attributes(delay))
+                if self._outbid():
+                    if not self._rebiddable():
+                        raise VastException('outbid')
+                    await asyncio.to_thread(self.bids.check)
+        finally:
+            self._time_phase(None)
+        return changes
+
+    async def _await_or_destroy(self):
+        try:
+            await self.async_wait()
+        except:
+            await self.adestroy()
+            raise
 
     def __del__(self):
-        if not self._detached:
+        # instances recorded in a store are left for Instance.restore after a restart
+        if not self._detached and self.vast.store is None:
             self.destroy()
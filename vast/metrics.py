@@ -0,0 +1,129 @@
+import collections, contextlib, contextvars, itertools, re, threading, time
+
+# the span being timed in the current context, if any
+active = contextvars.ContextVar('active_span', default=None)
+
+class Metrics:
+    '''
+    Receives the latency of each api call and of its phases, and counts of events such as
+    retries and throttling. Each call is a command, such as 'GET /instances' or 'show instances'.
+
+    The base class passes these to on_time(command, phase, seconds) and
+    on_count(command, event, n) if given, and otherwise is a no-op that skips timing entirely.
+    Subclasses can override time() and count() instead; MetricsRecorder aggregates in memory.
+
+    Phases are 'args' (argument and url building), 'argparse', 'ratelimit', 'network',
+    'backoff' and 'parse' (decoding output), each timed excluding any phase nested in it;
+    'total' is the whole call. Events are 'retry' and 'throttled'.
+    '''
+    def __init__(self, on_time = None, on_count = None):
+        self.on_time = on_time
+        self.on_count = on_count
+        self.enabled = on_time is not None or on_count is not None
+
+    def time(self, command, phase, seconds):
+        if self.on_time is not None:
+            self.on_time(command, phase, seconds)
+
+    def count(self, command, event, n = 1):
+        if self.on_count is not None:
+            self.on_count(command, event, n)
+
+    def command(self, name):
+        '''Times a call as command name, unless disabled or already within a command.'''
+        if not self.enabled or active.get() is not None:
+            return contextlib.nullcontext()
+        return Span(self, name, 'total')
+
+class Span:
+    '''Times a phase of a command, reporting it to metrics on exit.'''
+    __slots__ = ('metrics', 'command', 'phase', 'nested', '_start', '_token')
+
+    def __init__(self, metrics, command, phase):
+        self.metrics = metrics
+        self.command = command
+        self.phase = phase
+        self.nested = 0
+
+    def __enter__(self):
+        self._token = active.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        active.reset(self._token)
+        parent = active.get()
+        if parent is None:
+            self.metrics.time(self.command, self.phase, elapsed)
+        else:
+            parent.nested += elapsed
+            self.metrics.time(self.command, self.phase, elapsed - self.nested)
+
+def phase(name):
+    '''Times a phase of the command running in the current context, if any.'''
+    span = active.get()
+    if span is None:
+        return contextlib.nullcontext()
+    return Span(span.metrics, span.command, name)
+
+def count(event, n = 1):
+    '''Counts an event against the command running in the current context, if any.'''
+    span = active.get()
+    if span is not None:
+        span.metrics.count(span.command, event, n)
+
+def endpoint(method, subpath):
+    '''Names a REST call as a command, with ids elided so calls on different objects aggregate.'''
+    return f'{method} ' + re.sub(r'/\d+', '/{id}', subpath.split('?', 1)[0])
+
+def subcommand(params):
+    '''Names a vast_python command line as a command, such as 'show instances', without its arguments.'''
+    return ' '.join(itertools.takewhile(re.compile('[a-z][a-z-]*').fullmatch, map(str, params)))
+
+class MetricsRecorder(Metrics):
+    '''
+    Aggregates metrics in memory, keeping the last samples timings of each command phase.
+
+        vast = Vast(metrics = MetricsRecorder())
+        ...
+        print(vast.metrics.dump())
+    '''
+    def __init__(self, samples = 10000):
+        super().__init__()
+        self.enabled = True
+        self.samples = samples
+        self.timings = collections.defaultdict(lambda: collections.deque(maxlen=self.samples))
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def time(self, command, phase, seconds):
+        with self._lock:
+            self.timings[command, phase].append(seconds)
+
+    def count(self, command, event, n = 1):
+        with self._lock:
+            self.counts[command, event] += n
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counts.clear()
+
+    def percentiles(self, percents = (50, 90, 99)):
+        '''Returns {(command, phase): {percent: seconds}}, by nearest rank.'''
+        with self._lock:
+            timings = {key: sorted(samples) for key, samples in self.timings.items()}
+        return {
+            key: {percent: samples[min(len(samples) - 1, int(len(samples) * percent / 100))] for percent in percents}
+            for key, samples in timings.items()
+        }
+
+    def dump(self, percents = (50, 90, 99)):
+        '''Formats the percentiles in milliseconds and the event counts as a text table.'''
+        lines = [f'{"command":<32} {"phase":<10} {"n":>7} ' + ' '.join(f'{f"p{percent}":>9}' for percent in percents)]
+        for (command, phase), values in sorted(self.percentiles(percents).items()):
+            lines.append(f'{command:<32} {phase:<10} {len(self.timings[command, phase]):>7} ' + ' '.join(f'{values[percent] * 1000:>9.3f}' for percent in percents))
+        for (command, event), n in sorted(self.counts.items()):
+            lines.append(f'{command:<32} {event:<10} {n:>7}')
+        return '\n'.join(lines)
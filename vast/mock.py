@@ -0,0 +1,254 @@
+from . import logger
+from .query import ops
+
+import collections, http.server, json, operator, random, re, socket, threading, time
+from urllib.parse import urlparse, parse_qs
+
+class MockVast:
+    '''
+    A local stand-in for the Vast REST api, for testing and benchmarking without an account.
+
+    Serves the endpoints used by Vast's native path and docker_tags/offer_bid_price over http
+    on localhost, with market_size random offers. Each response is delayed by latency seconds;
+    a throttle_rate fraction of requests get 429 and an error_rate fraction get 500. New
+    instances report 'loading' for loading_time seconds before 'running', and their ssh
+    address points at a local listener that sends an ssh banner. The account hosts
+    host_machines unlisted machines for the host api.
+
+    Use as a context manager, or call start() and stop(). Vast(url = mock.url) talks to it.
+    counts tallies requests by (method, endpoint).
+    '''
+    def __init__(self, market_size = 1000, latency = 0, error_rate = 0, throttle_rate = 0, loading_time = 0, seed = 0, host_machines = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.loading_time = loading_time
+        self.random = random.Random(seed)
+        self.offers = {id: self._offer(id) for id in range(1, market_size + 1)}
+        self.instances = {}
+        self.machines = {id: dict(
+            id = id, listed = False, listed_gpu_cost = None, listed_storage_cost = None, listed_inet_up_cost = None,
+            listed_inet_down_cost = None, listed_min_gpu_count = None, end_date = None, min_bid_price = None,
+        ) for id in range(1, host_machines + 1)}
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self._next_id = 1
+        self._server = None
+        self._ssh = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        mock = self
+        class Handler(MockHandler):
+            pass
+        Handler.mock = mock
+        self._server = MockServer(('127.0.0.1', 0), Handler)
+        self._ssh = socket.create_server(('127.0.0.1', 0), backlog = 1024)
+        for target in (self._server.serve_forever, self._serve_ssh):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._ssh.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def perturb(self, n):
+        '''Changes the prices of n random offers, as the market moves.'''
+        with self.lock:
+            for offer in self.random.sample(list(self.offers.values()), min(n, len(self.offers))):
+                offer['dph_total'] = round(offer['dph_total'] * self.random.uniform(0.8, 1.2), 4)
+                offer['min_bid'] = round(offer['dph_total'] * self.random.uniform(0.3, 0.6), 4)
+
+    def _serve_ssh(self):
+        while True:
+            try:
+                connection, address = self._ssh.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    connection.sendall(b'SSH-2.0-MockVast\r\n')
+                except OSError:
+                    pass
+
+    def _offer(self, id):
+        gpu_name, gpu_ram, dlperf, price = self.random.choice([
+            ('RTX 3090', 24576, 30, 0.3), ('RTX 4090', 24564, 60, 0.6), ('A100 SXM4', 81920, 90, 1.5), ('RTX 3060', 12288, 12, 0.1),
+        ])
+        num_gpus = self.random.choice([1, 1, 2, 4, 8])
+        dph_total = round(price * num_gpus * self.random.uniform(0.7, 1.5), 4)
+        return dict(
+            id = id, machine_id = 10000 + id, gpu_name = gpu_name, num_gpus = num_gpus, gpu_ram = gpu_ram,
+            dlperf = round(dlperf * num_gpus * self.random.uniform(0.8, 1.1), 2), dph_total = dph_total,
+            min_bid = round(dph_total * self.random.uniform(0.3, 0.6), 4), cuda_max_good = self.random.choice([11.4, 11.8, 12.2]),
+            inet_down = round(self.random.uniform(50, 2000), 1), inet_up = round(self.random.uniform(50, 2000), 1),
+            reliability2 = round(self.random.uniform(0.9, 1), 4), disk_space = self.random.choice([100, 500, 2000]),
+            cpu_cores = 4 * num_gpus, cpu_ram = 32768 * num_gpus, verified = True, external = False, rentable = True, rented = False,
+            score = 0,
+        )
+
+    def _instance(self, row):
+        # a copy of an instance row with its status as of now
+        row = dict(row)
+        if row['intended_status'] == 'running' and row['actual_status'] == 'loading' and time.time() - row['start_date'] >= self.loading_time:
+            row['actual_status'] = 'running'
+            row['status_msg'] = 'success, running'
+        return row
+
+    def _search(self, q):
+        offers = [offer for offer in self.offers.values() if offer['rentable'] and _matches(offer, q)]
+        for field, direction in reversed(q.get('order', [])):
+            offers.sort(key = lambda offer: offer.get(field) or 0, reverse = direction == 'desc')
+        return offers
+
+    def handle(self, method, path, query, body):
+        '''Returns (status, json or text) for a request, updating the simulated account.'''
+        parts = [part for part in path.split('/') if part]
+        with self.lock:
+            if method == 'GET' and parts == ['instances']:
+                return 200, {'instances': [self._instance(row) for row in self.instances.values()]}
+            if method == 'GET' and parts == ['bundles']:
+                return 200, {'offers': self._search(json.loads(query.get('q', '{}')))}
+            if method == 'GET' and parts[:2] == ['docker', 'tags']:
+                return 200, [{'name': 'latest', 'min_cuda': 11.0, 'max_cuda': None, 'extra_filters': {}}]
+            if method == 'PUT' and parts[0] == 'bundles_bid_price':
+                offer = self.offers.get(int(parts[1]))
+                return (200, str(offer['min_bid'])) if offer else (404, {'msg': 'no_such_ask'})
+            if method == 'PUT' and parts[0] == 'asks':
+                offer = self.offers.get(int(parts[1]))
+                if offer is None or not offer['rentable']:
+                    return 400, {'success': False, 'error': 'invalid_args', 'msg': 'no_such_ask'}
+                offer['rentable'] = False
+                id = self._next_id
+                self._next_id += 1
+                price = body.get('price')
+                self.instances[id] = dict(
+                    id = id, machine_id = offer['machine_id'], offer_id = offer['id'], image_uuid = body.get('image'),
+                    label = body.get('label'), actual_status = 'loading', intended_status = 'running', next_state = 'running',
+                    status_msg = 'Pulling image', ssh_host = '127.0.0.1', ssh_port = self._ssh.getsockname()[1],
+                    dph_total = offer['dph_total'] if price is None else price, min_bid = offer['min_bid'],
+                    is_bid = price is not None, start_date = time.time(), gpu_name = offer['gpu_name'], num_gpus = offer['num_gpus'],
+                )
+                return 200, {'success': True, 'new_contract': id}
+            if parts[0] == 'instances' and len(parts) >= 2:
+                bid = parts[1] == 'bid_price'
+                id = int(parts[2] if bid else parts[1])
+                row = self.instances.get(id)
+                if row is None:
+                    return 404, {'msg': 'no_such_instance'}
+                if method == 'DELETE':
+                    del self.instances[id]
+                    self.offers[row['offer_id']]['rentable'] = True
+                elif bid:
+                    row['dph_total'] = body.get('price') or row['min_bid'] + 0.0001
+                elif 'state' in body:
+                    row['intended_status'] = row['next_state'] = body['state']
+                    row['actual_status'] = 'exited' if body['state'] == 'stopped' else 'loading'
+                    row['start_date'] = time.time()
+                elif 'label' in body:
+                    row['label'] = body['label']
+                return 200, {'success': True}
+            if method == 'PUT' and parts == ['commands', 'rsync']:
+                missing = [id for id in (body.get('src_id'), body.get('dst_id')) if id is not None and id not in self.instances]
+                return (400, {'success': False, 'msg': 'no_such_instance'}) if missing else (200, {'success': True})
+            if method == 'GET' and parts == ['users', 'current']:
+                return 200, {'id': 1, 'username': 'mock', 'credit': 100.0, 'api_key': query.get('api_key')}
+            if method == 'GET' and parts == ['users', 'me', 'invoices']:
+                return 200, {'invoices': [], 'current': {'charges': 0}}
+            if method == 'GET' and parts == ['machines']:
+                return 200, {'machines': [dict(machine) for machine in self.machines.values()]}
+            if parts[0] == 'machines':
+                if parts[1] == 'create_asks':
+                    machine = self.machines.get(body.get('machine'))
+                    if machine is None:
+                        return 400, {'success': False, 'msg': 'no_such_machine'}
+                    machine.update(
+                        listed = True, listed_gpu_cost = body.get('price_gpu'), listed_storage_cost = body.get('price_disk'),
+                        listed_inet_up_cost = body.get('price_inetu'), listed_inet_down_cost = body.get('price_inetd'),
+                        listed_min_gpu_count = body.get('min_chunk'), end_date = body.get('end_date'),
+                    )
+                elif parts[1].isdigit():
+                    machine = self.machines.get(int(parts[1]))
+                    if machine is None:
+                        return 404, {'msg': 'no_such_machine'}
+                    if parts[2:] == ['asks'] and method == 'DELETE':
+                        machine['listed'] = False
+                    elif parts[2:] == ['minbid']:
+                        machine['min_bid_price'] = body.get('price')
+                return 200, {'success': True}
+        return 404, {'msg': f'no mock for {method} {path}'}
+
+class MockServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # headers and body are written separately
+    mock = None
+
+    def _handle(self):
+        mock = self.mock
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'null') or {}
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint = re.sub(r'/\d+', '/{id}', url.path)
+        with mock.lock:
+            mock.counts[self.command, endpoint] += 1
+            roll = mock.random.random()
+        if mock.latency:
+            time.sleep(mock.latency)
+        if roll < mock.throttle_rate:
+            status, result = 429, {'msg': 'rate limited'}
+        elif roll < mock.throttle_rate + mock.error_rate:
+            status, result = 500, {'msg': 'internal error'}
+        else:
+            status, result = mock.handle(self.command, url.path, query, body)
+        data = (result if type(result) is str else json.dumps(result)).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        logger.debug('mock: ' + format % args)
+
+def _matches(offer, q):
+    for field, conditions in q.items():
+        if type(conditions) is not dict or field not in offer:
+            continue
+        value = offer[field]
+        for op, operand in conditions.items():
+            if op in ('in', 'notin'):
+                matched = str(value) in [str(item) for item in operand]
+                if matched != (op == 'in'):
+                    return False
+                continue
+            if type(operand) is str:
+                try:
+                    operand = float(operand) if operand.lower() not in ('true', 'false') else operand.lower() == 'true'
+                except ValueError:
+                    pass
+            try:
+                matched = ops[op](value, operand)
+            except TypeError:
+                matched = False
+            if not matched:
+                return False
+    return True
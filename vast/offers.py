@@ -0,0 +1,117 @@
+from .query import parse_query, parse_order, field_alias, ops
+
+import numpy as np
+
+
+def parse_value(value):
+    '''Converts a value from parse_query into the bool, float or str it compares as.'''
+    if type(value) is list:
+        return [parse_value(item) for item in value]
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+class OfferTable:
+    '''
+    A snapshot of offers stored column-wise as numpy arrays, so they can be filtered and
+    ranked repeatedly without further api calls.
+
+    Numeric and bool fields become float columns with None as nan; other fields are kept as
+    object columns. Filters use the same query syntax as Vast.offers.
+    '''
+    def __init__(self, offers, columns = None):
+        if columns is None:
+            columns = {}
+            for key in set().union(*offers) if len(offers) else ():
+                values = [offer.get(key) for offer in offers]
+                if all(value is None or type(value) in (int, float, bool) for value in values):
+                    columns[key] = np.array([np.nan if value is None else value for value in values], dtype=float)
+                else:
+                    columns[key] = np.empty(len(values), dtype=object)
+                    columns[key][:] = values
+            rows = np.empty(len(offers), dtype=object)
+            rows[:] = offers
+            offers = rows
+        self.offers = offers
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.offers)
+
+    def __iter__(self):
+        return iter(self.offers)
+
+    def __getitem__(self, field):
+        return self.columns[field_alias.get(field, field)]
+
+    def take(self, indices):
+        '''A new table of the offers selected by an index or boolean mask array.'''
+        return OfferTable(self.offers[indices], {key: column[indices] for key, column in self.columns.items()})
+
+    def mask(self, query):
+        '''A boolean array of which offers match query.'''
+        mask = np.ones(len(self), dtype=bool)
+        if not len(self):
+            return mask # an empty table has no columns to look fields up in
+        for field, conditions in parse_query(query).items():
+            column = self[field]
+            for op, value in conditions.items():
+                value = parse_value(value)
+                if op in ('in', 'notin'):
+                    if column.dtype == object:
+                        values = set(value)
+                        matches = np.fromiter((item in values for item in column), bool, len(column))
+                    else:
+                        matches = np.isin(column, value)
+                    if op == 'notin':
+                        matches = ~matches
+                elif column.dtype == object:
+                    matches = np.fromiter((item is not None and ops[op](item, value) for item in column), bool, len(column))
+                else:
+                    matches = ops[op](column, value)
+                mask &= matches
+        return mask
+
+    def filter(self, query):
+        return self.take(self.mask(query))
+
+    def score(self, expression):
+        '''
+        Evaluates expression over whole columns, e.g. 'dlperf / dph_total * reliability2'. Fields
+        and their query aliases are available by name, and numpy as np. expression may also be
+        a callable taking the table.
+        '''
+        if not len(self):
+            return np.zeros(0)
+        if callable(expression):
+            return np.asarray(expression(self), dtype=float)
+        namespace = {alias: self.columns[field] for alias, field in field_alias.items() if field in self.columns}
+        namespace.update(self.columns)
+        return np.asarray(eval(expression, {'np': np}, namespace), dtype=float) * np.ones(len(self))
+
+    def rank(self, expression, n = None, descending = True):
+        '''A new table ordered by a score expression, best first, optionally keeping only the top n.'''
+        scores = self.score(expression)
+        order = np.argsort(-scores if descending else scores, kind = 'stable')
+        return self.take(order[:n])
+
+    def sort(self, sort):
+        '''A new table ordered by a sort spec as in Vast.offers, such as 'score-,dph'.'''
+        if not len(self):
+            return self
+        keys = []
+        for field, direction in parse_order(sort):
+            column = self[field]
+            if column.dtype == object:
+                column = np.unique(column.astype(str), return_inverse = True)[1]
+            keys.append(-column if direction == 'desc' else column)
+        if not keys:
+            return self
+        return self.take(np.lexsort(keys[::-1]))
+
+    def rows(self, n = None):
+        '''The offer dicts, as returned by Vast.offers.'''
+        return list(self.offers[:n])
@@ -0,0 +1,38 @@
+from . import logger
+
+import threading
+
+class Periodic:
+    '''
+    Base for objects that call _tick() every interval in a background thread, between
+    start() and stop(). Exceptions from _tick are logged, and the next tick still runs.
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def _tick(self):
+        raise NotImplementedError
+
+    def start(self):
+        '''Starts the background thread, if it is not running, returning self.'''
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._tick()
+            except Exception as e:
+                logger.exception(e)
+            self._stopping.wait(self.interval)
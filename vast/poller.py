@@ -0,0 +1,133 @@
+from . import logger
+from .periodic import Periodic
+
+import random, threading, time
+
+class Poller(Periodic):
+    '''
+    Shares one Vast.instances() request per interval among everything tracking instances.
+    Rows do not have ssh_url and scp_url added; InstanceState derives them when needed.
+
+    Rows are kept by instance id. Subscribers are called with (instance_id, row) only when
+    their row changed, and with a row of None when the instance disappears. Subscribing to an
+    instance_id of None receives changes to every instance.
+    '''
+    def __init__(self, vast, interval = 4):
+        self.vast = vast
+        super().__init__(interval)
+        self.rows = {}
+        self.versions = {}
+        self.fetched = None
+        self.started = None # when the fetch behind the rows began
+        self.fetches = 0
+        self._subscribers = {}
+        self._fetch_lock = threading.RLock() # serialises fetches and updates
+        self._changed = threading.Condition()
+
+    def subscribe(self, instance_id, callback):
+        self._subscribers.setdefault(instance_id, []).append(callback)
+
+    def unsubscribe(self, instance_id, callback):
+        callbacks = self._subscribers.get(instance_id, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._subscribers.pop(instance_id, None)
+
+    @property
+    def age(self):
+        return float('inf') if self.fetched is None else time.monotonic() - self.fetched
+
+    def poll(self, max_age = 0):
+        '''
+        Fetches instances if the last fetch is older than max_age, returning the rows by id.
+        Concurrent callers share a single fetch, and a fetch begun after a caller asked is as
+        fresh as one of its own.
+        '''
+        asked = time.monotonic()
+        with self._fetch_lock:
+            if self.stale(max_age, asked):
+                started = time.monotonic()
+                self.update(self.vast.instances(urls = False), started)
+            return self.rows
+
+    def stale(self, max_age, asked):
+        '''Whether rows are needed newer than max_age, and newer than a caller asking at time.monotonic() asked.'''
+        return self.age > max_age and (self.started is None or self.started < asked)
+
+    def row(self, instance_id = None, machine_id = None, max_age = None):
+        '''Returns the latest row for an instance, polling only if it is older than max_age.'''
+        self.poll(self.interval if max_age is None else max_age)
+        row = self.find(instance_id, machine_id)
+        if row is None:
+            # may be newly created
+            self.poll()
+            row = self.find(instance_id, machine_id)
+        return row
+
+    def find(self, instance_id = None, machine_id = None):
+        '''Returns the current row for an instance id, or else machine id, without polling.'''
+        rows = self.rows
+        if instance_id is not None:
+            return rows.get(instance_id)
+        return next((row for row in rows.values() if row['machine_id'] == machine_id), None)
+
+    def wait(self, instance_id, timeout = None):
+        '''Blocks until the row for instance_id changes or timeout passes. Returns True if it changed.'''
+        with self._changed:
+            version = self.versions.get(instance_id)
+            return self._changed.wait_for(lambda: self.versions.get(instance_id) != version, timeout)
+
+    def hydrate(self, rows):
+        '''Fills in rows from a previous run without notifying subscribers. The next poll reconciles them.'''
+        with self._fetch_lock, self._changed:
+            self.rows = dict(rows)
+
+    def update(self, instances, started = None):
+        '''
+        Replaces the rows with a freshly fetched instance list, notifying subscribers of changes.
+        started is the time.monotonic() the fetch began. Updates and their notifications happen
+        one at a time.
+        '''
+        rows = {row['id']: row for row in instances}
+        with self._fetch_lock:
+            changed = [id for id, row in rows.items() if self.rows.get(id) != row]
+            changed.extend(id for id in self.rows if id not in rows)
+            self.fetched = time.monotonic()
+            self.started = started
+            self.fetches += 1
+            with self._changed:
+                self.rows = rows
+                for id in changed:
+                    self.versions[id] = self.versions.get(id, 0) + 1
+                self._changed.notify_all()
+            for id in changed:
+                for callback in [*self._subscribers.get(id, ()), *self._subscribers.get(None, ())]:
+                    try:
+                        callback(id, rows.get(id))
+                    except Exception as e:
+                        logger.exception(e)
+
+    def _tick(self):
+        self.poll(self.interval / 2)
+
+class PollSchedule:
+    '''
+    How long Instance.wait sleeps between polls in each phase of startup.
+
+    A phase is an actual_status, or 'connecting' while running but not yet accepting ssh.
+    phases maps each to (first interval, maximum interval); the interval grows by backoff
+    for each poll spent in the same phase, and is randomly varied by up to jitter of itself.
+    '''
+    def __init__(self, phases = None, default = (4, 30), backoff = 1.5, jitter = 0.1):
+        if phases is None:
+            phases = {'connecting': (1, 4), 'loading': (10, 60)}
+        self.phases = phases
+        self.default = default
+        self.backoff = backoff
+        self.jitter = jitter
+
+    def delay(self, phase, polls):
+        first, maximum = self.phases.get(phase, self.default)
+        delay = min(first * self.backoff ** polls, maximum)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
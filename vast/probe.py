@@ -0,0 +1,95 @@
+import asyncio, bisect, socket, threading, time
+
+class Prober:
+    '''
+    Checks whether ssh endpoints accept connections, giving up on each after timeout seconds.
+
+    If banner is True an endpoint only counts as connectable once it sends an ssh version
+    banner, not merely when it accepts tcp. The last result for each key is kept in results
+    as (connectable, latency, time.time()), and latencies are counted into histogram by
+    their upper bound in buckets, with the last count for slower probes.
+
+    A connectable result is reused for the same key and endpoint for up to max_age seconds
+    without probing again. Unconnectable endpoints are always probed, as callers are waiting
+    for them to change.
+    '''
+    def __init__(self, timeout = 4, banner = False, buckets = (0.01, 0.03, 0.1, 0.3, 1, 3, 10), concurrency = 256, max_age = 10):
+        self.timeout = timeout
+        self.max_age = max_age
+        self.banner = banner
+        self.buckets = buckets
+        self.concurrency = concurrency
+        self.histogram = [0] * (len(buckets) + 1)
+        self.results = {}
+        self._endpoints = {} # key -> (host, port) of its result
+        self._lock = threading.Lock()
+
+    def probe(self, host, port, key = None):
+        '''Probes one endpoint, blocking for at most timeout seconds.'''
+        if host is None or port is None:
+            return False
+        if self._cached(host, port, key):
+            return True
+        start = time.monotonic()
+        try:
+            with socket.create_connection((host, port), self.timeout) as sock:
+                if self.banner:
+                    sock.settimeout(max(self.timeout - (time.monotonic() - start), 0.001))
+                    connectable = sock.makefile('rb').readline(256).startswith(b'SSH-')
+                else:
+                    connectable = True
+        except OSError:
+            connectable = False
+        return self._record(host, port, key, connectable, time.monotonic() - start)
+
+    async def aprobe(self, host, port, key = None):
+        '''Probes one endpoint without blocking the event loop.'''
+        if host is None or port is None:
+            return False
+        if self._cached(host, port, key):
+            return True
+        start = time.monotonic()
+        try:
+            connectable = await asyncio.wait_for(self._aprobe(host, port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            connectable = False
+        return self._record(host, port, key, connectable, time.monotonic() - start)
+
+    async def _aprobe(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            return not self.banner or (await reader.readline()).startswith(b'SSH-')
+        finally:
+            writer.close()
+
+    async def aprobe_many(self, endpoints):
+        '''Probes a dict of {key: (host, port)} concurrently, returning {key: connectable}.'''
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def probe(key, host, port):
+            async with semaphore:
+                return await self.aprobe(host, port, key)
+        results = await asyncio.gather(*(probe(key, host, port) for key, (host, port) in endpoints.items()))
+        return dict(zip(endpoints, results))
+
+    def probe_many(self, endpoints):
+        '''Probes a dict of {key: (host, port)} concurrently from synchronous code.'''
+        return asyncio.run(self.aprobe_many(endpoints))
+
+    def latencies(self):
+        '''The histogram as a list of (upper bound in seconds, count).'''
+        return list(zip((*self.buckets, float('inf')), self.histogram))
+
+    def _cached(self, host, port, key):
+        # whether a recent probe of this endpoint found it connectable
+        key = (host, port) if key is None else key
+        with self._lock:
+            result = self.results.get(key)
+            return result is not None and result[0] and time.time() - result[2] < self.max_age and self._endpoints.get(key) == (host, port)
+
+    def _record(self, host, port, key, connectable, latency):
+        key = (host, port) if key is None else key
+        with self._lock:
+            self.histogram[bisect.bisect_left(self.buckets, latency)] += 1
+            self.results[key] = (connectable, latency, time.time())
+            self._endpoints[key] = (host, port)
+        return connectable
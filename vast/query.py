@@ -0,0 +1,80 @@
+import operator, re
+
+# these mirror the search syntax understood by vast_python, so that queries can be built without it
+
+op_names = {
+    '>=': 'gte', '>': 'gt', 'gt': 'gt', 'gte': 'gte',
+    '<=': 'lte', '<': 'lt', 'lt': 'lt', 'lte': 'lte',
+    '!=': 'neq', '==': 'eq', '=': 'eq', 'eq': 'eq', 'neq': 'neq', 'noteq': 'neq', 'not eq': 'neq',
+    'notin': 'notin', 'not in': 'notin', 'nin': 'notin', 'in': 'in',
+}
+
+# the comparisons behind each api op other than in and notin, for filtering offers locally
+ops = {'eq': operator.eq, 'neq': operator.ne, 'lt': operator.lt, 'lte': operator.le, 'gt': operator.gt, 'gte': operator.ge}
+
+field_alias = {
+    'cuda_vers': 'cuda_max_good',
+    'display_active': 'gpu_display_active',
+    'reliability': 'reliability2',
+    'dlperf_usd': 'dlperf_per_dphtotal',
+    'dph': 'dph_total',
+    'flops_usd': 'flops_per_dphtotal',
+}
+
+field_multiplier = {
+    'cpu_ram': 1000,
+    'gpu_ram': 1000,
+    'duration': 1.0 / (24.0 * 60.0 * 60.0),
+}
+
+query_re = re.compile(r'([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|[^ ]+)?( *)')
+
+def parse_query(query, res = None):
+    '''
+    Converts a query string such as 'inet_down>=200 gpu_name in [RTX_3090,A100]' into the dict
+    of {field: {op: value}} used by the api.
+    '''
+    if res is None:
+        res = {}
+    if type(query) is not str:
+        query = ' '.join(query)
+    query = query.strip()
+    opts = query_re.findall(query)
+    if ''.join(''.join(opt) for opt in opts) != query:
+        raise ValueError(f'Unconsumed text in query: {query!r}')
+    for field, op, _, value, _ in opts:
+        field = field_alias.get(field, field)
+        op_name = op_names.get(op.strip())
+        if op_name is None:
+            raise ValueError(f'Unknown operator in query: {op!r}')
+        value = value.strip(',[]')
+        if op_name in ('in', 'notin'):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        if not value:
+            raise ValueError(f'Value cannot be blank in query: {(field, op, value)!r}')
+        if value in ('?', '*', 'any'):
+            if op_name != 'eq':
+                raise ValueError('Wildcard only makes sense with equals.')
+            res.pop(field, None)
+            continue
+        if field in field_multiplier:
+            value = str(float(value) * field_multiplier[field])
+        if type(value) is str:
+            value = value.replace('_', ' ')
+        else:
+            value = [item.replace('_', ' ') for item in value]
+        res.setdefault(field, {})[op_name] = value
+    return res
+
+def parse_order(sort):
+    '''Converts a sort spec such as 'score-,dph' into the api's [[field, direction], ...] form.'''
+    if type(sort) is not str:
+        sort = ','.join(sort)
+    order = []
+    for name in sort.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        field = name.strip('-')
+        order.append([field_alias.get(field, field), 'asc' if field == name else 'desc'])
+    return order
@@ -0,0 +1,182 @@
+from . import VastException, logger
+from .cache import SingleFlight
+from . import metrics
+
+import email.utils, functools, json, random, requests, threading, time
+
+class TokenBucket:
+    '''Allows rate requests per second on average, in bursts of up to burst.'''
+    def __init__(self, rate = 10, burst = 20):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '''Takes a token, returning how many seconds to wait before using it.'''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(-self._tokens / self.rate, 0)
+
+class RetryPolicy:
+    '''
+    Retries throttled and failed requests up to retries times, waiting as the server's
+    Retry-After says, or else an exponentially growing, fully jittered delay.
+    '''
+    def __init__(self, retries = 5, base = 0.5, maximum = 30, statuses = (429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.base = base
+        self.maximum = maximum
+        self.statuses = statuses
+
+    def delay(self, attempt, retry_after = None):
+        if retry_after is not None:
+            return min(retry_after, self.maximum)
+        return random.uniform(0, min(self.base * 2 ** attempt, self.maximum))
+
+class CircuitBreaker:
+    '''
+    Fails calls fast for cooldown seconds after threshold consecutive failures, then lets a
+    trial call through to see whether the api has recovered.
+    '''
+    def __init__(self, threshold = 5, cooldown = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self._opened is not None:
+                if time.monotonic() - self._opened < self.cooldown:
+                    raise VastException(f'api unavailable after {self.failures} consecutive failures')
+                self._opened = time.monotonic() # one trial call per cooldown
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened = time.monotonic()
+
+def error_message(status, text):
+    '''The detail of an error response with status and body text, as vast_python words it.'''
+    try:
+        return json.loads(text).get('msg')
+    except ValueError:
+        return 'Please log in or sign up' if status == 401 else '(no detail message supplied)'
+
+def handle_httperror(e):
+    # retrying is left to the session, so this only forms the error
+    raise VastException(f'failed with error {e.response.status_code}: {error_message(e.response.status_code, e.response.text)}')
+
+def check_success(result):
+    # the api can report failure in a successful response, as vast_python prints
+    if type(result) is dict and result.get('success') is False:
+        raise VastException(result.get('msg') or result.get('error') or 'failed')
+    return result
+
+def retry_after(headers):
+    '''The seconds asked for by a Retry-After header, or None.'''
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(date.timestamp() - time.time(), 0)
+
+class RetryingSession:
+    '''
+    Wraps a requests session so that each request waits on a rate limiter, fails fast while a
+    circuit breaker is open, and is retried on throttling, server errors and dropped connections.
+
+    Requests made with idempotent=False are only retried when throttled, as the server may
+    have acted on them otherwise. Attempts without a timeout of their own give up after
+    timeout seconds, counting as dropped connections. The last response is returned even if
+    it is an error, for the caller to raise.
+
+    Identical concurrent GET requests share one round trip through flights; each caller still
+    decodes its own copy of the body. Any other request makes later GETs go out anew, so
+    they see its effects.
+    '''
+    def __init__(self, session, limiter = None, policy = None, breaker = None, flights = None, timeout = 60):
+        self.session = session
+        self.timeout = timeout
+        self.flights = SingleFlight() if flights is None else flights
+        self.limiter = TokenBucket() if limiter is None else limiter
+        self.policy = RetryPolicy() if policy is None else policy
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+        self.retries = 0
+        self.throttled = 0
+
+    def request(self, method, url, idempotent = True, **kwparams):
+        if method in ('GET', 'HEAD') and kwparams.get('json') is None and kwparams.get('data') is None:
+            return self.flights.do((method, url), lambda: self._request(method, url, idempotent, **kwparams))
+        self.flights.forget()
+        try:
+            return self._request(method, url, idempotent, **kwparams)
+        finally:
+            # reads made while this was in progress may not reflect it either
+            self.flights.forget()
+
+    def _request(self, method, url, idempotent, **kwparams):
+        attempt = 0
+        while True:
+            self.breaker.check()
+            with metrics.phase('ratelimit'):
+                time.sleep(self.limiter.reserve())
+            try:
+                with metrics.phase('network'):
+                    response = self.session.request(method, url, **{'timeout': self.timeout, **kwparams})
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                delay = self.backoff(attempt, None, idempotent = idempotent)
+                if delay is None:
+                    raise
+            else:
+                delay = self.backoff(attempt, response.status_code, retry_after(response.headers), idempotent)
+                if delay is None:
+                    return response
+            logger.debug(f'retrying {method} in {delay}s')
+            with metrics.phase('backoff'):
+                time.sleep(delay)
+            attempt += 1
+
+    get = functools.partialmethod(request, 'GET')
+    head = functools.partialmethod(request, 'HEAD')
+    post = functools.partialmethod(request, 'POST')
+    put = functools.partialmethod(request, 'PUT')
+    patch = functools.partialmethod(request, 'PATCH')
+    delete = functools.partialmethod(request, 'DELETE')
+
+    def backoff(self, attempt, status, retry_after = None, idempotent = True):
+        '''
+        Updates the breaker with the outcome of an attempt, returning how long to wait before
+        retrying it, or None if it should not be retried. A status of None is a connection error.
+        '''
+        if status == 429:
+            self.throttled += 1
+            metrics.count('throttled')
+        elif status is None or status >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        if status is not None and status not in self.policy.statuses:
+            return None
+        if status != 429 and not idempotent:
+            return None
+        if attempt >= self.policy.retries:
+            return None
+        self.retries += 1
+        metrics.count('retry')
+        return self.policy.delay(attempt, retry_after)
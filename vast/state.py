@@ -0,0 +1,83 @@
+import threading, time
+
+missing = object()
+
+class InstanceState:
+    '''
+    The latest fields of one instance as the api reports them, readable as attributes.
+
+    Values are kept in a list indexed by a schema of field names shared by every state, so
+    a state holds no dict of its own, and update() only stores fields whose value changed,
+    returning them as a change-set of {field: new value}. A row equal to the previous one is
+    recognised with a single comparison. ssh_url, scp_url, outbid and max_cost are derived
+    from the other fields when read.
+    '''
+    __slots__ = ('_values', '_row')
+    _schema = {} # field name -> index into _values
+    _schema_lock = threading.Lock()
+
+    def __init__(self, row = None):
+        self._values = []
+        self._row = None
+        if row is not None:
+            self.update(row)
+
+    def update(self, row, **overrides):
+        '''
+        Stores the fields of row that changed, with overrides replacing some of its values,
+        returning the changes. overrides should depend only on row, as they are not checked
+        when row is unchanged.
+        '''
+        if row == self._row:
+            return {}
+        self._row = row
+        schema = self._schema
+        values = self._values
+        changes = {}
+        for key, value in row.items():
+            if overrides and key in overrides:
+                value = overrides[key]
+            index = schema.get(key)
+            if index is None:
+                with self._schema_lock:
+                    index = schema.setdefault(key, len(schema))
+            if index >= len(values):
+                values.extend([missing] * (index + 1 - len(values)))
+            old = values[index]
+            if old is not value and old != value:
+                values[index] = value
+                changes[key] = value
+        return changes
+
+    def __getattr__(self, name):
+        index = self._schema.get(name)
+        if index is not None and index < len(self._values):
+            value = self._values[index]
+            if value is not missing:
+                return value
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def get(self, name, default = None):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            return default
+
+    def as_dict(self):
+        return {key: self._values[index] for key, index in self._schema.items() if index < len(self._values) and self._values[index] is not missing}
+
+    @property
+    def ssh_url(self):
+        return f'ssh://root@{self.ssh_host}:{self.ssh_port}'
+
+    @property
+    def scp_url(self):
+        return f'scp://root@{self.ssh_host}:{self.ssh_port}'
+
+    @property
+    def outbid(self):
+        return self.min_bid + 0.0001 > self.dph_total and self.is_bid
+
+    @property
+    def max_cost(self):
+        return self.dph_total / 3600 * (time.time() - self.start_date)
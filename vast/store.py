@@ -0,0 +1,79 @@
+import json, sqlite3, threading, time
+
+class Store:
+    '''
+    A SQLite file of instance rows, the instances this controller created with the offers
+    they came from, and offer snapshots, so that a restarted controller starts from its last
+    known state.
+
+    Given as Vast(store = ...), it hydrates the Poller's rows when the Poller is created and
+    then records each row change the Poller reports, so a cold start needs no requests, and
+    the first poll reconciles everything with one. Instances recorded as owned are not
+    destroyed when their Instance objects are collected; Instance.restore() recreates them.
+    OfferWatchers start from the last snapshot of their search, and snapshot each result.
+    '''
+    def __init__(self, path = ':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS instances (id INTEGER PRIMARY KEY, row TEXT, owned INTEGER NOT NULL DEFAULT 0, offer TEXT, updated REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS offers (search TEXT NOT NULL, id INTEGER NOT NULL, row TEXT NOT NULL, taken REAL NOT NULL, PRIMARY KEY (search, id))')
+
+    def update(self, instance_id, row):
+        '''Records a changed Poller row, or forgets an instance when row is None. A Poller subscriber.'''
+        with self._lock:
+            if row is None:
+                self._db.execute('DELETE FROM instances WHERE id = ?', (instance_id,))
+            else:
+                self._db.execute(
+                    'INSERT INTO instances (id, row, updated) VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET row = excluded.row, updated = excluded.updated',
+                    (instance_id, json.dumps(row), time.time())
+                )
+
+    def rows(self):
+        '''The last known row of each instance, by id.'''
+        with self._lock:
+            return {id: json.loads(row) for id, row in self._db.execute('SELECT id, row FROM instances WHERE row IS NOT NULL')}
+
+    def own(self, instance_id, offer = None):
+        '''Records an instance as created by this controller, from offer.'''
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO instances (id, owned, offer, updated) VALUES (?, 1, ?, ?) ON CONFLICT (id) DO UPDATE SET owned = 1, offer = excluded.offer',
+                (instance_id, json.dumps(offer), time.time())
+            )
+
+    def disown(self, instance_id):
+        with self._lock:
+            self._db.execute('UPDATE instances SET owned = 0 WHERE id = ?', (instance_id,))
+
+    def owned(self):
+        '''The offer of each instance this controller created, by id.'''
+        with self._lock:
+            return {id: json.loads(offer) for id, offer in self._db.execute('SELECT id, offer FROM instances WHERE owned')}
+
+    def save_offers(self, search, offers):
+        '''Snapshots the offers found by a search, named by a string, replacing its last snapshot.'''
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('DELETE FROM offers WHERE search = ?', (search,))
+            self._db.executemany(
+                'INSERT INTO offers (search, id, row, taken) VALUES (?, ?, ?, ?)',
+                ((search, offer['id'], json.dumps(offer), now) for offer in offers)
+            )
+            self._db.execute('COMMIT')
+
+    def offers(self, search, max_age = None):
+        '''The last snapshot of a search's offers, or [] if there is none taken within max_age seconds.'''
+        since = float('-inf') if max_age is None else time.time() - max_age
+        with self._lock:
+            return [json.loads(row) for row, in self._db.execute('SELECT row FROM offers WHERE search = ? AND taken >= ?', (search, since))]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,151 @@
+from . import VastException, logger
+from .retry import RetryPolicy
+
+import collections, concurrent.futures, requests, threading, time
+
+class Transfer:
+    '''
+    One copy between a local path or (instance_id, path) and another, with its outcome.
+
+    size is the number of bytes copied, if known, for throughput in bytes per second.
+    '''
+    def __init__(self, src, dest, size = None):
+        self.src = src
+        self.dest = dest
+        self.size = size
+        self.attempts = 0
+        self.started = None
+        self.seconds = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.seconds is not None and self.error is None
+
+    @property
+    def throughput(self):
+        if not self.done or self.size is None or not self.seconds:
+            return None
+        return self.size / self.seconds
+
+    def __repr__(self):
+        state = f'{self.seconds:.1f}s' if self.done else repr(self.error) if self.error else 'pending'
+        return f'Transfer({self.src!r} -> {self.dest!r}, {state}, {self.attempts} attempts)'
+
+class TransferManager:
+    '''
+    Copies data to and between instances with Vast.copy, up to parallelism copies at once.
+
+    A failed copy is reissued up to retries times with backoff; rsync only sends what the
+    destination is missing, so this resumes it. Copies between two instances are only
+    initiated by the api, so if verify is given, a copy is not counted as done until
+    verify(transfer) returns True, checked every check_interval seconds for up to
+    verify_timeout. Throughput is measured over that whole time.
+
+    Every transfer is kept in transfers by (src, dest), and retry_failed() reissues the ones
+    that ran out of retries.
+    '''
+    def __init__(self, vast, parallelism = 8, retries = 3, verify = None, check_interval = 10, verify_timeout = 3600, identity = None):
+        self.vast = vast
+        self.parallelism = parallelism
+        self.policy = RetryPolicy(retries, base = 2, maximum = 60)
+        self.verify = verify
+        self.check_interval = check_interval
+        self.verify_timeout = verify_timeout
+        self.identity = identity
+        self.transfers = {}
+        self._lock = threading.Lock()
+
+    def copy(self, src, dest, size = None):
+        '''Performs one transfer, retrying it as needed, and returns it; failures are recorded on it rather than raised.'''
+        with self._lock:
+            transfer = self.transfers.get((src, dest))
+            if transfer is None or transfer.error is not None:
+                transfer = self.transfers[src, dest] = Transfer(src, dest, size)
+            elif transfer.done:
+                return transfer
+        transfer.started = time.monotonic()
+        while True:
+            transfer.attempts += 1
+            try:
+                self.vast.copy(src, dest, self.identity)
+                self._verify(transfer)
+                transfer.seconds = time.monotonic() - transfer.started
+                logger.info(f'{transfer} at {transfer.throughput or "unknown"} B/s')
+                return transfer
+            except (VastException, requests.exceptions.RequestException) as e:
+                if transfer.attempts > self.policy.retries:
+                    transfer.error = e
+                    transfer.seconds = time.monotonic() - transfer.started
+                    logger.warning(f'{transfer} failed')
+                    return transfer
+                delay = self.policy.delay(transfer.attempts - 1)
+                logger.warning(f'{src} -> {dest} failed, retrying in {delay}s: {e}')
+                time.sleep(delay)
+
+    def _verify(self, transfer):
+        if self.verify is None:
+            return
+        deadline = time.monotonic() + self.verify_timeout
+        while not self.verify(transfer):
+            if time.monotonic() >= deadline:
+                raise VastException(f'{transfer.src} -> {transfer.dest} not complete after {self.verify_timeout}s')
+            time.sleep(self.check_interval)
+
+    def fan_out(self, src, instances, path, size = None):
+        '''Copies src directly to path on each of instances concurrently, returning the Transfers.'''
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            return list(pool.map(lambda id: self.copy(src, (id, path), size), map(instance_id, instances)))
+
+    def relay(self, src, instances, path, size = None):
+        '''
+        Copies src to path on the first of instances, then on to the rest from whichever
+        instances already have it, so the number of copies in flight doubles each round
+        up to parallelism. Returns the Transfers; instances whose copy failed are not
+        relayed from. Without verify, a copy between instances is done once the api accepts
+        it, before the data has arrived, so only the first instance is relayed from.
+        '''
+        ids = [instance_id(instance) for instance in instances]
+        if not ids:
+            return []
+        seed = self.copy(src, (ids[0], path), size)
+        if not seed.done:
+            return [seed]
+        transfers = [seed]
+        holders = [ids[0]]
+        pending = collections.deque(ids[1:])
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            while pending or running:
+                while holders and pending and len(running) < self.parallelism:
+                    source, target = holders.pop(), pending.popleft()
+                    running[pool.submit(self.copy, (source, path), (target, path), size)] = (source, target)
+                done, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    source, target = running.pop(future)
+                    transfer = future.result()
+                    transfers.append(transfer)
+                    holders.append(source)
+                    if transfer.done and self.verify is not None:
+                        holders.append(target)
+        return transfers
+
+    def retry_failed(self):
+        '''Reissues every transfer that failed, concurrently, returning them.'''
+        failed = [transfer for transfer in self.transfers.values() if transfer.error is not None]
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            return list(pool.map(lambda transfer: self.copy(transfer.src, transfer.dest, transfer.size), failed))
+
+    def stats(self):
+        transfers = list(self.transfers.values())
+        done = [transfer for transfer in transfers if transfer.done]
+        rates = [transfer.throughput for transfer in done if transfer.throughput is not None]
+        return dict(
+            done = len(done), failed = sum(transfer.error is not None for transfer in transfers),
+            pending = len(transfers) - len(done) - sum(transfer.error is not None for transfer in transfers),
+            bytes = sum(transfer.size or 0 for transfer in done), mean_throughput = sum(rates) / len(rates) if rates else None,
+        )
+
+def instance_id(instance):
+    # accepts Instances or ids
+    return getattr(instance, 'id', instance)
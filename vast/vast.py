@@ -1,14 +1,85 @@
-from . import VastException
-from .vast_cmd import vast_cmd, handle_httperror, server_url_default
+from . import VastException, logger
+from .query import parse_query, parse_order
+from .poller import Poller
+from .cache import TTLCache, SingleFlight
+from .probe import Prober
+from .retry import RetryingSession, TokenBucket, RetryPolicy, CircuitBreaker, handle_httperror, check_success
+from .metrics import Metrics, phase, endpoint, subcommand
 #from .instance import Instance
-import json, requests, threading
+import collections, concurrent.futures, datetime, json, os, requests, threading, time
+from urllib.parse import quote_plus, urlparse
+
+# the same defaults as vast_python, which is only imported once a command needs it
+server_url_default = 'https://vast.ai/api/v0'
+api_key_file = os.path.expanduser('~/.vast_api_key')
 
 # this should change into a VastAPI class, and then a Vast class could model Instances with objects, and update their properties all at once.
 class Vast:
-    def __init__(self, url = server_url_default, key = None, identity = None):
+    def __init__(self, url = server_url_default, key = None, identity = None, native = True, session = None, pool_size = 10, tags_ttl = 3600, tags_cache_path = None, rate = 10, burst = 20, retries = 5, fresh = 0, metrics = None, store = None, timeout = 60):
+        '''
+        If native is True, commands are sent directly to the REST api as json. Otherwise they
+        are run through the vast_python command line parser and its printed output is scraped.
+
+        All network calls go through session, which defaults to a keep-alive requests.Session
+        holding up to pool_size connections per host. Requests are limited to rate per second in
+        bursts of up to burst, retried up to retries times with backoff when throttled, failing
+        or unanswered after timeout seconds, and failed fast by a circuit breaker while the api
+        is down. Identical concurrent reads share one request, as do reads within fresh seconds
+        of a completed one, unless a write was sent since.
+
+        docker_tags results are cached per image repo for tags_ttl seconds, and persisted to
+        tags_cache_path if it is given.
+
+        Each call's latency, split into phases, and its retries are reported to metrics, a
+        Metrics such as a MetricsRecorder; by default nothing is recorded.
+
+        If store is given, as a Store or the path of one, instance state and OfferWatcher
+        results are kept in it across restarts.
+        '''
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        if key is None and os.path.exists(api_key_file):
+            with open(api_key_file, 'r') as reader:
+                key = reader.read().strip()
         self.url = url
         self.key = key
         self.identity = identity
+        self.native = native
+        self.session = session
+        self.http = RetryingSession(session, TokenBucket(rate, burst), RetryPolicy(retries), CircuitBreaker(), SingleFlight(fresh), timeout)
+        self.tags_cache = TTLCache(ttl = tags_ttl, path = tags_cache_path)
+        self._poller = None
+        self._avast = None
+        self.prober = Prober()
+        self.metrics = Metrics() if metrics is None else metrics
+        if type(store) is str:
+            from .store import Store
+            store = Store(store)
+        self.store = store
+        self._lock = threading.Lock()
+
+    @property
+    def poller(self):
+        '''The Poller that Instances using this Vast share their status requests through.'''
+        with self._lock:
+            if self._poller is None:
+                self._poller = Poller(self)
+                if self.store is not None:
+                    self._poller.hydrate(self.store.rows())
+                    self._poller.subscribe(None, self.store.update)
+            return self._poller
+
+    @property
+    def avast(self):
+        '''An AsyncVast sharing this Vast's account and Poller, for use from asyncio.'''
+        with self._lock:
+            if self._avast is None:
+                from .async_vast import AsyncVast
+                self._avast = AsyncVast(self)
+            return self._avast
 
     def copy(self, src, dest, identity = None):
         '''
@@ -17,14 +88,23 @@ class Vast:
         permissions required to carry out the action. The format for both src and dst is (instance_id, path) or
         just plain path.
         '''
+        remote = type(src) is tuple and type(dest) is tuple
+        if remote and self.native:
+            result = self.request('PUT', '/commands/rsync/', body = {
+                'client_id': 'me', 'src_id': src[0], 'dst_id': dest[0], 'src_path': src[1], 'dst_path': dest[1],
+            }, idempotent = False)
+            if not result.get('success'):
+                raise VastException(result.get('msg'))
+            return
         if type(src) is tuple and len(src) == 2:
             src = f'{src[0]}:{src[1]}'
-        if type(dest) is tuple and len(dst) == 2:
+        if type(dest) is tuple and len(dest) == 2:
             dest = f'{dest[0]}:{dest[1]}'
         if identity is None:
             identity = self.identity
 
-        self.cmd('copy', src, dest, identity = identity, expect='Remote to Remote copy initiated')
+        # copies involving a local path run rsync within the command, rather than initiating
+        self.cmd('copy', src, dest, identity = identity, expect='Remote to Remote copy initiated' if remote else None)
 
     def offers(self, instance_type = 'on-demand', bundling = True, pricing_storage_GiB = 5.0, sort = ('score-',), query = 'external=false rentable=true verified=true'):
         '''
@@ -80,6 +160,9 @@ class Vast:
             verified:               bool      is the machine verified
         '''
 
+        if self.native:
+            return self.request('GET', '/bundles', query = offers_query(instance_type, bundling, pricing_storage_GiB, sort, query))['offers']
+
         if type(sort) is not str:
             sort = ','.join(sort)
 
@@ -90,15 +173,23 @@ class Vast:
 
         return tables[0][0]
 
-    def instances(self):
-        '''The stats on the machines the user is renting.'''
+    def offer_table(self, *params, **kwparams):
+        '''
+        Runs one offers search, taking the same arguments, and returns the results as an
+        OfferTable for repeated client-side filtering and ranking. Requires numpy.
+        '''
+        from .offers import OfferTable
+        return OfferTable(self.offers(*params, **kwparams))
+
+    def instances(self, urls = True):
+        '''The stats on the machines the user is renting, with ssh_url and scp_url added to each if urls is True.'''
         
-        printlines, tables = self.cmd('show', 'instances')       
-        result = tables[0][0]
-        for instance in result:
-            instance['ssh_url'] = f'ssh://root@{instance["ssh_host"]}:{instance["ssh_port"]}'
-            instance['scp_url'] = f'scp://root@{instance["ssh_host"]}:{instance["ssh_port"]}'
-        return result
+        if self.native:
+            result = self.request('GET', '/instances', query = {'owner': 'me'})['instances']
+        else:
+            printlines, tables = self.cmd('show', 'instances')
+            result = tables[0][0]
+        return add_urls(result) if urls else result
 
     def ssh_url(self):
         '''ssh url helper'''
@@ -120,12 +211,16 @@ class Vast:
 
     def machines(self, ids_only=False):
         '''Show the machines user is offering for rent.'''
-        printlines, tables = self.cmd('show', 'machines', quiet=ids_only)
+        if self.native:
+            machines = self.request('GET', '/machines', query = {'owner': 'me'})['machines']
+            return [machine['id'] for machine in machines] if ids_only else machines
 
         if ids_only:
-            return [int(id) for id in printlines]
+            printlines, tables = self.cmd('show', 'machines', quiet=True)
+            return [int(line[0]) for line in printlines]
         else:
-            return [json.loads(line.split(': ', 1)) for line in printlines[1:]]
+            printlines, tables = self.cmd('show', 'machines', raw=True)
+            return json.loads(printlines[0][0])
 
     def invoices(self, start_date = None, end_date = None, only_charges=False, only_credits=False):
         '''
@@ -134,12 +229,26 @@ class Vast:
 
         Returns history, current_charges
         '''
+        if self.native:
+            response = self.request('GET', '/users/me/invoices', query = {'owner': 'me', 'inc_charges': not only_credits})
+            start, end = timestamp(start_date, 0), timestamp(end_date, float('inf'))
+            history = [
+                row for row in response['invoices']
+                if start <= (row['timestamp'] or 0.0) <= end and float(row['amount']) != 0
+                    and (not only_charges or row['type'] == 'charge')
+                    and (not only_credits or row['type'] == 'payment')
+            ]
+            return history, response['current']
         printlines, tables = self.cmd('show', 'invoices', start_date=start_date, end_date=end_date, only_charges=only_charges, only_credits=only_credits)
         current_charges = printlines[-1][1]
         return tables[0][0], current_charges
 
     def user(self):
         '''Stats for logged-in user.'''
+        if self.native:
+            user = self.request('GET', '/users/current', query = {'owner': 'me'})
+            user.pop('api_key', None)
+            return user
         printlines, tables = self.cmd('show', 'user')
         return tables[0][0][0]
 
@@ -151,45 +260,116 @@ class Vast:
 
     def list_machine(self, id=None, price_gpu=None, price_disk=None, price_inetu=None, price_inetd=None, min_chunk=None, end_timestamp=None):
         '''[Host] list a machine for rent'''
+        if self.native:
+            self.request('PUT', '/machines/create_asks/', body = {
+                'machine': id, 'price_gpu': price_gpu, 'price_disk': price_disk,
+                'price_inetu': price_inetu, 'price_inetd': price_inetd,
+                'min_chunk': min_chunk, 'end_date': end_timestamp,
+            })
+            return
         self.cmd('list', 'machine',
             id, price_gpu=price_gpu, price_disk=price_disk,
             price_inetu=price_inetu, price_inetd=price_inetd,
-            min_chunk=min_chunk, end_date=end_date,
+            min_chunk=min_chunk, end_date=end_timestamp,
             expect = 'offers created')
 
     def unlist_machine(self, id):
         '''[Host] Removes machine from list of machines for rent.'''
-        self.cmd('unlist', 'machine', id, expect='all offers for machine')
+        if self.native:
+            self.request('DELETE', f'/machines/{id}/asks/')
+        else:
+            self.cmd('unlist', 'machine', id, expect='all offers for machine')
 
     def remove_defjob(self, id):
         '''[Host] Delete default jobs'''
-        self.cmd('remove', 'defjob', id, expect='default instances for machine')
+        if self.native:
+            self.request('DELETE', f'/machines/{id}/defjob/')
+        else:
+            self.cmd('remove', 'defjob', id, expect='default instances for machine')
 
     def start(self, instance_id):
         '''Start a stopped instance'''
-        self.cmd('start', 'instance', instance_id, expect='starting instance')
+        if self.native:
+            self.request('PUT', f'/instances/{instance_id}/', body = {'state': 'running'})
+        else:
+            self.cmd('start', 'instance', instance_id, expect='starting instance')
 
     def stop(self, instance_id):
         '''Stop a running instance'''
-        self.cmd('stop', 'instance', instance_id, expect='stopping instance ')
+        if self.native:
+            self.request('PUT', f'/instances/{instance_id}/', body = {'state': 'stopped'})
+        else:
+            self.cmd('stop', 'instance', instance_id, expect='stopping instance ')
 
     def label(self, instance_id, label):
         '''Assign a string label to an instance'''
-        self.cmd('label', 'instance', instance_id, label, expect='label for ')
+        if self.native:
+            self.request('PUT', f'/instances/{instance_id}/', body = {'label': label})
+        else:
+            self.cmd('label', 'instance', instance_id, label, expect='label for ')
 
     def destroy(self, instance_id):
         '''
         Destroy an instance (irreversible, deletes data)
         Perfoms the same action as pressing the "DESTROY" button on the website at https://vast.ai/console/instances/.
         '''
-        self.cmd('destroy', 'instance', instance_id, expect='destroying instance ')
+        if self.native:
+            self.request('DELETE', f'/instances/{instance_id}/', body = {})
+        else:
+            self.cmd('destroy', 'instance', instance_id, expect='destroying instance ')
+
+    def destroy_all(self, parallelism = 16):
+        '''Destroys every instance the user is renting, returning a BulkResult.'''
+        return self.destroy_many([instance['id'] for instance in self.instances()], parallelism)
 
-    def destroy_all(self):
-        for instance in self.instances():
-            self.destroy(instance['id'])
+    def destroy_many(self, instance_ids, parallelism = 16):
+        '''Destroys instances concurrently, returning a BulkResult rather than stopping at the first failure.'''
+        return self.bulk(self.destroy, {instance_id: () for instance_id in instance_ids}, parallelism)
+
+    def start_many(self, instance_ids, parallelism = 16):
+        '''Starts stopped instances concurrently, returning a BulkResult.'''
+        return self.bulk(self.start, {instance_id: () for instance_id in instance_ids}, parallelism)
+
+    def stop_many(self, instance_ids, parallelism = 16):
+        '''Stops running instances concurrently, returning a BulkResult.'''
+        return self.bulk(self.stop, {instance_id: () for instance_id in instance_ids}, parallelism)
+
+    def label_many(self, instance_ids, label = None, parallelism = 16):
+        '''Labels instances concurrently. instance_ids may be a dict of {instance_id: label}.'''
+        return self.bulk(self.label, per_instance(instance_ids, label), parallelism)
+
+    def change_bid_many(self, instance_ids, price = None, parallelism = 16):
+        '''Changes bids concurrently. instance_ids may be a dict of {instance_id: price}.'''
+        return self.bulk(self.change_bid, per_instance(instance_ids, price), parallelism)
+
+    def bulk(self, func, params_by_id, parallelism = 16):
+        '''
+        Calls func(instance_id, *params) for each item of params_by_id with up to parallelism
+        calls at once, collecting each return value or exception into a BulkResult.
+        '''
+        start = time.monotonic()
+        results, errors = {}, {}
+        with concurrent.futures.ThreadPoolExecutor(max(min(parallelism, len(params_by_id)), 1)) as pool:
+            futures = {pool.submit(func, instance_id, *params): instance_id for instance_id, params in params_by_id.items()}
+            for future in concurrent.futures.as_completed(futures):
+                instance_id = futures[future]
+                try:
+                    results[instance_id] = future.result()
+                except Exception as e:
+                    logger.warning(f'{func.__name__} {instance_id} failed: {e}')
+                    errors[instance_id] = e
+        seconds = time.monotonic() - start
+        logger.info(f'{func.__name__} succeeded for {len(results)} of {len(params_by_id)} in {seconds}s')
+        return BulkResult(results, errors, seconds)
 
     def set_defjob(self, id, price_gpu=None, price_inetu=None, price_inetd=None, image=None, args=None):
         '''[Host] Create default jobs for a machine'''
+        if self.native:
+            self.request('PUT', '/machines/create_bids/', body = {
+                'machine': id, 'price_gpu': price_gpu, 'price_inetu': price_inetu, 'price_inetd': price_inetd,
+                'image': image, 'args': args,
+            })
+            return
         self.cmd('set', 'defjob', id,
             price_gpu=price_gpu, price_inetu=price_inetu, price_inetd=price_inetd, image=image, args=args,
             expect='bids created for machine '
@@ -200,6 +380,11 @@ class Vast:
         Create a new instance
         Performs the same action as pressing the "RENT" button on the website at https://vast.ai/console/create/.
         '''
+        if self.native:
+            return self.request('PUT', f'/asks/{offer_id}/', body = create_body(
+                image, disk_GB, price, label, onstart, onstart_cmd, jupyter, jupyter_dir, jupyter_lab,
+                lang_utf8, python_utf8, extra, create_from, force
+            ), idempotent = False)['new_contract']
         printlines, tables = self.cmd('create', 'instance', offer_id,
             price=price, disk=disk_GB, image=image, label=label, onstart=onstart, onstart_cmd=onstart_cmd,
             jupyter=jupyter, jupyter_dir=jupyter_dir, jupyter_lab=jupyter_lab, lang_utf8=lang_utf8,
@@ -213,6 +398,9 @@ class Vast:
 
         If PRICE is not specified, then a winning bid price is used as the default.
         '''
+        if self.native:
+            self.request('PUT', f'/instances/bid_price/{instance_id}/', body = {'client_id': 'me', 'price': price})
+            return
         self.cmd('change', 'bid', instance_id, price=price, expect='Per gpu bid price changed')
 
     def set_min_bid(self, machine_id, price=None):
@@ -221,6 +409,9 @@ class Vast:
 
         Change the current min bid price of machine id to PRICE.
         '''
+        if self.native:
+            self.request('PUT', f'/machines/{machine_id}/minbid/', body = {'client_id': 'me', 'price': price})
+            return
         self.cmd('set', 'min_bid', machine_id, price=price, expect='Per gpu min bid price changed')
 
     def set_key(self, new_api_key):
@@ -232,23 +423,31 @@ class Vast:
         self.cmd('set', 'api_key', new_api_key, expect='Your api key has been saved in ')
         
     def docker_tags(self, image):
-        while True:
-            try:
-                response = requests.get(f'{self.url}/docker/tags/?repo={image}')
-                break
-            except requests.exceptions.HTTPError as e:
-                if handle_httperror(e):
-                    continue
-        return response.json()
+        '''The tags of a docker image repo, with their cuda bounds and filters. Cached in tags_cache.'''
+        return self.tags_cache.get_or_set(image, lambda: self._docker_tags(image))
+
+    def _docker_tags(self, image):
+        return self.send('GET', f'{self.url}/docker/tags/?repo={image}').json()
 
     def offer_bid_price(self, offer_id):
-        while True:
-            try:
-                response = requests.put(f'{self.url}/bundles_bid_price/{offer_id}/', json={})
-            except requests.exceptions.HTTPError as e:
-                if handle_httperror(e):
-                    continue
-        return float(response.text)
+        return float(self.send('PUT', f'{self.url}/bundles_bid_price/{offer_id}/', json={}).text)
+
+    def connection_stats(self):
+        '''
+        Returns a dict of how many http connections the session has opened, and how many
+        requests reused an already open connection.
+        '''
+        opened = requested = 0
+        for adapter in set(self.session.adapters.values()):
+            poolmanager = getattr(adapter, 'poolmanager', None)
+            if poolmanager is None:
+                continue
+            for key in poolmanager.pools.keys():
+                pool = poolmanager.pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    requested += pool.num_requests
+        return dict(opened = opened, reused = max(requested - opened, 0))
         
     def params2args(self, *params, mutate_hyphens = False, **kwparams):
         params = (str(param) for param in params)
@@ -269,16 +468,104 @@ class Vast:
 
         return params
 
+    def url_for(self, subpath, query = None):
+        '''Forms the REST api url for subpath, with the api key and json-encoded query parameters.'''
+        query = dict(query or {})
+        if self.key is not None:
+            query['api_key'] = self.key
+        url = self.url + subpath
+        if query:
+            url += '?' + '&'.join(f'{key}={quote_plus(val if type(val) is str else json.dumps(val))}' for key, val in query.items())
+        return url
+
+    def request(self, method, subpath, query = None, body = None, idempotent = True):
+        '''
+        Directly performs a REST api request, returning the decoded json response, or raising
+        VastException if it reports success as false.
+        Requests that may have effects if repeated should pass idempotent=False.
+        '''
+        with self.metrics.command(endpoint(method, subpath)):
+            with phase('args'):
+                url = self.url_for(subpath, query)
+            logger.debug(f'{method} {subpath}')
+            response = self.send(method, url, idempotent, json=body)
+            with phase('parse'):
+                return check_success(response.json())
+
+    def send(self, method, url, idempotent = True, **kwparams):
+        '''Sends an http request through the rate limiter, retries and breaker, raising VastException on failure.'''
+        with self.metrics.command(endpoint(method, url[len(self.url):] if url.startswith(self.url) else urlparse(url).path)):
+            response = self.http.request(method, url, idempotent, **kwparams)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            handle_httperror(e)
+        return response
+
     def cmd(self, *params, mutate_hyphens = False, expect = None, **kwparams):
         '''
         Directly executes the passed vast_python library command, returning print and table output as
         a 2-tuple of lists.
         '''
 
-        params = self.params2args(*params, mutate_hyphens = mutate_hyphens, **kwparams)
-        
-        printlines, tables = vast_cmd(*params)
+        with self.metrics.command(subcommand(params)):
+            with phase('args'):
+                params = self.params2args(*params, mutate_hyphens = mutate_hyphens, **kwparams)
+
+            from .vast_cmd import vast_cmd
+            printlines, tables = vast_cmd(*params, session = self.http)
 
         if expect is not None and not str(printlines[-1][0]).startswith(expect):
             raise VastException(*printlines)
         return printlines, tables
+
+class BulkResult(collections.namedtuple('BulkResult', ('results', 'errors', 'seconds'))):
+    '''The {instance_id: return value} and {instance_id: exception} of a bulk call, and its wall time. True if nothing failed.'''
+    def __bool__(self):
+        return not self.errors
+
+def per_instance(instance_ids, value):
+    # bulk params from a dict of {instance_id: value}, or the same value for each id
+    if isinstance(instance_ids, dict):
+        return {instance_id: (value,) for instance_id, value in instance_ids.items()}
+    return {instance_id: (value,) for instance_id in instance_ids}
+
+def offers_query(instance_type, bundling, pricing_storage_GiB, sort, query):
+    '''Forms the query parameters of a native offer search.'''
+    q = parse_query(query, {})
+    q['order'] = parse_order(sort)
+    q['type'] = 'bid' if instance_type == 'interruptible' else instance_type
+    q['allocated_storage'] = pricing_storage_GiB
+    if not bundling:
+        q['disable_bundling'] = True
+    return {'q': q}
+
+def create_body(image, disk_GB=10, price=None, label=None, onstart='', onstart_cmd=None, jupyter=False, jupyter_dir=None, jupyter_lab=False, lang_utf8=False, python_utf8=False, extra=None, create_from=None, force=False):
+    '''Forms the json body of a native create request.'''
+    if onstart:
+        with open(onstart, 'r') as reader:
+            onstart_cmd = reader.read()
+    if jupyter_dir or jupyter_lab:
+        jupyter = True
+    return {
+        'client_id': 'me', 'image': image, 'price': price, 'disk': disk_GB, 'label': label,
+        'extra': extra, 'onstart': onstart_cmd, 'runtype': 'jupyter' if jupyter else 'ssh',
+        'python_utf8': python_utf8, 'lang_utf8': lang_utf8, 'use_jupyter_lab': jupyter_lab,
+        'jupyter_dir': jupyter_dir, 'create_from': create_from, 'force': force,
+    }
+
+def add_urls(instances):
+    for instance in instances:
+        instance['ssh_url'] = f'ssh://root@{instance["ssh_host"]}:{instance["ssh_port"]}'
+        instance['scp_url'] = f'scp://root@{instance["ssh_host"]}:{instance["ssh_port"]}'
+    return instances
+
+def timestamp(date, default):
+    '''Converts a date given as a number, datetime, or iso format string into a unix timestamp.'''
+    if date is None:
+        return default
+    if type(date) is str:
+        date = datetime.datetime.fromisoformat(date)
+    if isinstance(date, datetime.datetime):
+        return date.timestamp()
+    return float(date)
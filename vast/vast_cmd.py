@@ -1,42 +1,68 @@
-import os, requests, sys, threading, time
+import contextvars, functools, os, requests, sys, threading
 
 import vast
 import vast.vast_python.vast
-from .vast_python.vast import parser, api_key_guard, api_key_file_base, api_key_file, server_url_default, JSONDecodeError, apiurl
+from .retry import RetryingSession, handle_httperror
+from .metrics import phase
+from .vast_python.vast import parser, api_key_guard, api_key_file_base, api_key_file, server_url_default
 
 parser.add_argument('--url', help='server REST api url', default=server_url_default)
 parser.add_argument('--raw', action='store_true', help='output machine-readable json');
 parser.add_argument('--api-key', help='api key. defaults to using the one stored in {}'.format(api_key_file_base),
                         type=str, required=False, default=api_key_guard)
 
-lock = threading.Lock()
+# only argument parsing touches shared state; output is captured per call so commands can run concurrently
+parse_lock = threading.Lock()
 
-wrap_print_output = []
-def wrap_print(*params, file=sys.stdout):
-    if file is not sys.stdout:
+# (print output, display_table output) of the command running in the current context
+wrapped_output = contextvars.ContextVar('wrapped_output')
+
+def wrap_print(*params, file=None):
+    # compared when called, as sys.stdout may have been redirected since
+    if file is not None and file is not sys.stdout:
         raise vast.VastException(params)
-    global wrap_print_output
     vast.logger.debug(' '.join((str(param) for param in params)))
-    wrap_print_output.append(params)
+    wrapped_output.get()[0].append(params)
 vast.vast_python.vast.print = wrap_print
 
-wrap_display_table_output = []
 def wrap_display_table(records : list, field_details):
-    global wrap_display_table_output
-    wrap_display_table_output.append((records, field_details))
+    wrapped_output.get()[1].append((records, field_details))
 vast.vast_python.vast.display_table = wrap_display_table
 
+# the requests session used by the command running in the current context
+wrapped_session = contextvars.ContextVar('wrapped_session', default=requests)
+
+class SessionRequests:
+    '''
+    Stands in for the requests module within vast_python, so its calls go through the caller's
+    session. Through a RetryingSession, only GET and HEAD are retried on failure, as which
+    other commands are safe to repeat cannot be told; renting twice would cost twice.
+    '''
+    def __getattr__(self, attr):
+        if attr in ('request', 'get', 'head', 'post', 'put', 'patch', 'delete'):
+            session = wrapped_session.get()
+            if not isinstance(session, RetryingSession):
+                return getattr(session, attr)
+            if attr == 'request':
+                return lambda method, url, **kwparams: session.request(method, url, method.upper() in ('GET', 'HEAD'), **kwparams)
+            return functools.partial(session.request, attr.upper(), idempotent = attr in ('get', 'head'))
+        return getattr(requests, attr)
+vast.vast_python.vast.requests = SessionRequests()
+
 def gather_wrapped(args):
-    global wrap_print_output, wrap_display_table_output
-    args.func(args)
-    result = (list(wrap_print_output), list(wrap_display_table_output))
-    wrap_print_output = []
-    wrap_display_table_output = []
+    result = ([], [])
+    token = wrapped_output.set(result)
+    try:
+        with phase('parse'): # network calls within are timed separately
+            args.func(args)
+    finally:
+        wrapped_output.reset(token)
     return result
 
 
 def parse_args(argv):
-   args = parser.parse_args(argv=argv)
+   with phase('argparse'), parse_lock:
+       args = parser.parse_args(argv=argv)
    if args.api_key is api_key_guard:
        if os.path.exists(api_key_file):
            with open(api_key_file, 'r') as reader:
@@ -45,39 +71,13 @@ def parse_args(argv):
            args.api_key = None
    return args
 
-def handle_httperror(e):
-    try:
-        errmsg = e.response.json().get('msg');
-    except JSONDecodeError:
-        if e.response.status_code == 401:
-            errmsg = 'Please log in or sign up'
-        elif e.response.status_code == 429: # rate limit
-            time.sleep(1)
-            return True
-        else:
-            errmsg = '(no detail message supplied)'
-    raise vast.VastException(f'failed with error {e.response.status_code}: {errmsg}')
-
-def vast_request(subpath, argv = [], query_kwparams={}, method='GET', request_kwparams={}):
-    vast.logger.debug('vast_request ' + ' '.join((str(param) for param in argv)))
-    while True:
-        with lock:
-            args = parse_args(argv=argv)
-            url = apiurl(args, subpath=subpath, query_args = query_kwparams)
-            try:
-                return requests.request(url, method=method, **request_kwparams)
-            except requests.exceptions.HTTPError as e:
-                if handle_httperror(e):
-                    continue
-        
-
-def vast_cmd(*argv):
+def vast_cmd(*argv, session=requests):
     vast.logger.debug('vast.py ' + ' '.join((str(param) for param in argv)))
-    while True:
-        with lock:
-            args = parse_args(argv=argv)
-            try:
-                return gather_wrapped(args)
-            except requests.exceptions.HTTPError as e:
-                if handle_httperror(e):
-                    continue
+    args = parse_args(argv=argv)
+    token = wrapped_session.set(session)
+    try:
+        return gather_wrapped(args)
+    except requests.exceptions.HTTPError as e:
+        handle_httperror(e)
+    finally:
+        wrapped_session.reset(token)
@@ -0,0 +1,90 @@
+from . import logger
+from .periodic import Periodic
+
+import asyncio, collections, json
+
+class OfferChanges(collections.namedtuple('OfferChanges', 'added removed changed')):
+    '''Lists of added and removed offer dicts, and (old, new) pairs of changed ones.'''
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+class OfferWatcher(Periodic):
+    '''
+    Repeats an offers search, keeping the last results by offer id and reporting only what changed.
+
+    An offer counts as changed when any of fields differs. Changes are passed to subscribers,
+    returned from poll(), and yielded by iterating the watcher asynchronously. Search
+    parameters are those of Vast.offers.
+
+    If vast has a store, the watcher starts from the stored snapshot of the same search, if
+    one was taken within max_age seconds, without announcing it, and stores each result.
+    '''
+    def __init__(self, vast, interval = 30, fields = ('dph_total', 'min_bid'), max_age = None, **search_kwparams):
+        self.vast = vast
+        super().__init__(interval)
+        self.fields = fields
+        self.offers = {}
+        self._search_kwparams = search_kwparams
+        self._search = json.dumps(search_kwparams, sort_keys = True, default = str) # names the search in the store
+        self._keys = {}
+        self._subscribers = []
+        if vast.store is not None:
+            self._replace(vast.store.offers(self._search, max_age))
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def update(self, offers):
+        '''Replaces the snapshot with a fresh search result, returning and announcing the changes.'''
+        changes = self._replace(offers)
+        if self.vast.store is not None:
+            self.vast.store.save_offers(self._search, offers)
+        if changes:
+            for callback in list(self._subscribers):
+                try:
+                    callback(changes)
+                except Exception as e:
+                    logger.exception(e)
+        return changes
+
+    def _replace(self, offers):
+        # replaces the snapshot, returning the changes
+        fields = self.fields
+        old_offers, old_keys = self.offers, self._keys
+        new_offers = {}
+        new_keys = {}
+        added = []
+        changed = []
+        for offer in offers:
+            id = offer['id']
+            key = tuple(offer.get(field) for field in fields)
+            new_offers[id] = offer
+            new_keys[id] = key
+            old_key = old_keys.get(id)
+            if old_key is None:
+                added.append(offer)
+            elif old_key != key:
+                changed.append((old_offers[id], offer))
+        removed = [offer for id, offer in old_offers.items() if id not in new_offers] if len(new_offers) - len(added) != len(old_offers) else []
+        self.offers, self._keys = new_offers, new_keys
+        return OfferChanges(added, removed, changed)
+
+    def poll(self):
+        return self.update(self.vast.offers(**self._search_kwparams))
+
+    def _tick(self):
+        self.poll()
+
+    async def apoll(self):
+        return self.update(await self.vast.avast.offers(**self._search_kwparams))
+
+    async def __aiter__(self):
+        '''Yields the nonempty changes of each asynchronous poll, every interval.'''
+        while True:
+            changes = await self.apoll()
+            if changes:
+                yield changes
+            await asyncio.sleep(self.interval)